@@ -0,0 +1,321 @@
+'''
+Cat-Printer: Benchmarks, for development
+
+Usage: python3 benchmark.py [name ...]
+Runs all benchmarks if no name is given.
+
+No rights reserved.
+License CC0-1.0-only: https://directory.fsf.org/wiki/License:CC0
+'''
+
+import io
+import os
+import sys
+import time
+import zipfile
+import tempfile
+import threading
+import urllib.request
+
+from printer_lib import bitmap
+from printer_lib.commander import Commander, reverse_bits
+from printer_lib.text_print import TextCanvas
+from printer_lib.pf2 import PF2S
+from printer_lib.pf2cache import compile_pf2, load_font
+
+def measure(function, *args, repeat=3):
+    'Run `function` for `repeat` times, return the best time in seconds'
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def report(name, amount, seconds, unit='MB'):
+    'Print a line of benchmark result'
+    print(f'  {name:<32}{amount / seconds:>12.2f} {unit}/s')
+
+def legacy_flip(buffer, width, height, horizontally=False, vertically=True):
+    'The `flip` from before `printer_lib.bitmap`, for reference'
+    buffer.seek(0)
+    data_width = width // 8
+    result_0 = io.BytesIO()
+    if horizontally:
+        while data := buffer.read(data_width):
+            data = bytearray(map(reverse_bits, data))
+            data.reverse()
+            result_0.write(data)
+        result_0.seek(0)
+    else:
+        result_0 = buffer
+    result_1 = io.BytesIO()
+    if vertically:
+        for i in range(height - 1, -1, -1):
+            result_0.seek(i * data_width)
+            data = result_0.read(data_width)
+            result_1.write(data)
+        result_1.seek(0)
+    else:
+        result_1 = result_0
+    buffer.seek(0)
+    while data := result_1.read(data_width):
+        buffer.write(data)
+    buffer.seek(0)
+    return result_1
+
+def bench_flip():
+    'Bitmap flip, `printer_lib.bitmap` against the legacy one'
+    width = 384
+    numpy = bitmap.numpy
+    for name, height in (('receipt', 2000), ('banner', 100000)):
+        data = bytearray(os.urandom(width // 8 * height))
+        megabytes = len(data) / 1024 / 1024
+        print(f'{name}, {width}x{height}, {megabytes:.2f} MB:')
+        for flip_h, flip_v in ((False, True), (True, False), (True, True)):
+            label = 'flip' + ('h' if flip_h else '') + ('v' if flip_v else '')
+            report(f'{label} legacy', megabytes, measure(
+                legacy_flip, io.BytesIO(data), width, height, flip_h, flip_v, repeat=1
+            ))
+            bitmap.numpy = None
+            report(f'{label} python', megabytes, measure(
+                bitmap.flip, data, width, height, flip_h, flip_v
+            ))
+            if numpy is not None:
+                bitmap.numpy = numpy
+                report(f'{label} numpy', megabytes, measure(
+                    bitmap.flip, data, width, height, flip_h, flip_v
+                ))
+    bitmap.numpy = numpy
+
+class CollectingCommander(Commander):
+    'A `Commander` that just collects what is sent'
+    def __init__(self):
+        self.sent = bytearray()
+    def send(self, data):
+        self.sent += data
+
+def bench_encode():
+    'Bitmap command encoding, per line against in bulk'
+    width = 384
+    line_width = width // 8
+    for name, height in (('receipt', 2000), ('banner', 100000)):
+        data = bytearray(os.urandom(line_width * height))
+        megabytes = len(data) / 1024 / 1024
+        print(f'{name}, {width}x{height}, {megabytes:.2f} MB:')
+        def per_line():
+            commander = CollectingCommander()
+            for i in range(0, len(data), line_width):
+                commander.draw_bitmap(data[i:i + line_width])
+            return commander.sent
+        def in_bulk(block_lines):
+            commander = CollectingCommander()
+            view = memoryview(data)
+            step = line_width * block_lines
+            for i in range(0, len(data), step):
+                commander.draw_bitmap_lines(view[i:i + step], line_width)
+            return commander.sent
+        if per_line() != in_bulk(64):
+            print('  Results differ!')
+        report('draw_bitmap', megabytes, measure(per_line, repeat=1))
+        for block_lines in (64, 256, 1024):
+            report(f'draw_bitmap_lines, {block_lines} lines', megabytes,
+                   measure(in_bulk, block_lines))
+
+def receipt_bitmap(line_width, height):
+    'Make a mostly white bitmap, with bands of "text" like a receipt'
+    lines = []
+    for i in range(height):
+        if i % 24 < 16:
+            lines.append(bytes(line_width))
+        else:
+            lines.append(bytes(b if b < 0x30 else 0 for b in os.urandom(line_width)))
+    return b''.join(lines)
+
+def bench_compress():
+    'Compressed bitmap commands for new kind of printers, size and speed'
+    width = 384
+    line_width = width // 8
+    height = 2000
+    commander = CollectingCommander()
+    for name, data in (
+        ('receipt', receipt_bitmap(line_width, height)),
+        ('noise', os.urandom(line_width * height))
+    ):
+        megabytes = len(data) / 1024 / 1024
+        plain = commander.make_bitmap_commands(data, line_width)
+        compressed = commander.make_compressed_bitmap_commands(data, line_width)
+        print(f'{name}, {width}x{height}: {len(plain)} bytes plain, '
+              f'{len(compressed)} bytes compressed '
+              f'({len(compressed) / len(plain) * 100:.1f}%)')
+        report('make_bitmap_commands', megabytes, measure(
+            commander.make_bitmap_commands, data, line_width))
+        report('make_compressed_bitmap_commands', megabytes, measure(
+            commander.make_compressed_bitmap_commands, data, line_width))
+
+def open_pf2(name='unifont'):
+    'Open a PF2 font like `PrinterDriver` does, or return `None` if not found'
+    path = name + '.pf2'
+    for parent in ('', 'pf2/'):
+        if os.path.exists(full_path := os.path.join(parent, path)):
+            return open(full_path, 'rb')
+    if os.path.exists('pf2.zip'):
+        with zipfile.ZipFile('pf2.zip') as pf2zip:
+            if path in pf2zip.namelist():
+                return io.BytesIO(pf2zip.read(path))
+    return None
+
+class LegacyTextCanvas(TextCanvas):
+    'A `TextCanvas` that puts glyphs bit by bit, like before, for reference'
+    def put_char(self, char, x, y, canvas=None):
+        canvas = self.canvas if canvas is None else canvas
+        canvas_length = len(canvas)
+        for char_x in range(char.width):
+            for char_y in range(char.height):
+                position = self.width * (y + char_y) + x + char_x
+                canvas_byte = position // 8
+                canvas_bit = 7 - position % 8
+                if canvas_byte < 0 or canvas_byte >= canvas_length:
+                    continue
+                canvas[canvas_byte] |= char.get_bit(char_x, char_y) << canvas_bit
+
+def bench_text():
+    'Text rendering with PF2 font (unifont), in glyphs per second'
+    font_data = open_pf2()
+    if font_data is None:
+        print('  No unifont.pf2 found, skipped')
+        return
+    font_data = font_data.read()
+    text = ('The quick brown fox jumps over the lazy dog. 0123456789 '
+            '敏捷的棕色狐狸跳过了懒狗。 ') * 40
+    glyphs = len(text)
+    for scale in (1, 2):
+        for rtl in (False, True):
+            canvases = [
+                canvas_class(384, rtl=rtl, scale=scale, wrap=True,
+                             font_data_io=io.BytesIO(font_data))
+                for canvas_class in (LegacyTextCanvas, TextCanvas)
+            ]
+            def render(canvas):
+                return b''.join(canvas.puttext(text))
+            label = f'scale {scale}' + (', rtl' if rtl else '')
+            if render(canvases[0]) != render(canvases[1]):
+                print(f'  Results differ with {label}!')
+            report(f'{label}, legacy', glyphs, measure(render, canvases[0], repeat=1),
+                   unit='glyphs')
+            report(f'{label}, by row', glyphs, measure(render, canvases[1]),
+                   unit='glyphs')
+            canvas = canvases[1]
+            lines = list(canvas.layout(text))
+            report(f'{label}, layout only', glyphs, measure(
+                lambda: list(canvas.layout(text))), unit='glyphs')
+            report(f'{label}, rasterize only', glyphs, measure(
+                lambda: [canvas.rasterize(line) for line in lines]), unit='glyphs')
+
+def bench_font():
+    'Font startup (unifont), raw PF2 against precompiled cache'
+    font_data = open_pf2()
+    if font_data is None:
+        print('  No unifont.pf2 found, skipped')
+        return
+    text = 'The quick brown fox 敏捷的棕色狐狸跳过了懒狗'
+    with tempfile.TemporaryDirectory() as directory:
+        font_path = os.path.join(directory, 'unifont.pf2')
+        with open(font_path, 'wb') as file:
+            file.write(font_data.read())
+        for scale in (1, 2):
+            cache_path = os.path.join(directory, f'unifont.s{scale}.pf2c')
+            with open(font_path, 'rb') as file, open(cache_path, 'wb') as output:
+                compile_pf2(file, output, scale)
+            def start(use_cache):
+                font = (load_font(open(font_path, 'rb'), cache_path, scale) if use_cache
+                        else PF2S(open(font_path, 'rb'), scale=scale))
+                for char in text:
+                    _ = font[char]
+                return font
+            for label, use_cache in (('pf2', False), ('cache', True)):
+                seconds = measure(start, use_cache, repeat=5)
+                print(f'  scale {scale}, {label:<24}{seconds * 1000:>12.2f} ms to first line')
+
+def bench_server():
+    'Web server, latency of requests when idle and during a print'
+    try:
+        from server import PrinterServer, PrinterServerHandler, DictAsObject
+    except ImportError as e:
+        print(f'  {e}, skipped')
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        class Handler(PrinterServerHandler):
+            'Handler that keeps config in a temporary directory'
+            settings = DictAsObject({**PrinterServerHandler.settings,
+                                     'config_path': os.path.join(directory, 'config.json')})
+        server = PrinterServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        def request(path, body=None):
+            start = time.perf_counter()
+            with urllib.request.urlopen(url + path, body) as response:
+                response.read()
+            return time.perf_counter() - start
+        def latency(label):
+            for name, path, body in (('static', '/index.html', None),
+                                     ('query', '/query', b'{}')):
+                times = sorted(request(path, body) for _ in range(50))
+                print(f'  {label + ", " + name:<32}{times[len(times) // 2] * 1000:>12.2f} ms median,'
+                      f' {times[-1] * 1000:.2f} ms max')
+        latency('idle')
+        # keep the printer worker busy, like a print over BLE does
+        printing = server.worker.submit(time.sleep, 3)
+        latency('printing')
+        if printing.done():
+            print('  Print finished before the requests, result is not meaningful')
+        server.shutdown()
+        server.server_close()
+
+def bench_pool():
+    'Printer pool, jobs done per second by amount of printers, each job takes 0.1 s'
+    try:
+        from server import PrinterPool, PrintJob, PrinterDriver
+    except ImportError as e:
+        print(f'  {e}, skipped')
+        return
+    amount = 16
+    def run(_job, _pooled):
+        # like printing 200 lines at 2000 lines per second
+        time.sleep(0.1)
+    for printers in (1, 2, 4):
+        pool = PrinterPool()
+        for _ in range(printers):
+            pool.add(PrinterDriver())
+        jobs = [PrintJob(i, 'pbm', 0, 0, width=384, estimated_rows=200) for i in range(amount)]
+        start = time.perf_counter()
+        for job in jobs:
+            pool.submit(job, run)
+        for job in jobs:
+            job.wait()
+        report(f'{printers} printer(s)', amount, time.perf_counter() - start, unit='jobs')
+        pool.stop()
+
+Benchmarks = {
+    'flip': bench_flip,
+    'encode': bench_encode,
+    'compress': bench_compress,
+    'text': bench_text,
+    'font': bench_font,
+    'server': bench_server,
+    'pool': bench_pool
+}
+
+def main():
+    'Run benchmarks given in command line, or all of them'
+    names = sys.argv[1:] or list(Benchmarks)
+    for name in names:
+        if name not in Benchmarks:
+            print(f'Unknown benchmark: {name}. Available: {", ".join(Benchmarks)}')
+            sys.exit(1)
+    for name in names:
+        print(f'# {name}: {Benchmarks[name].__doc__}')
+        Benchmarks[name]()
+
+if __name__ == '__main__':
+    main()
@@ -36,6 +36,7 @@ additional_ignore = (
     '.git', '.gitignore',
     '.vscode', '.pylintrc',
     'dev-diary.txt', 'TODO',
+    'benchmark.py', 'tests',
     # cache
     '*.pyc',
     # other
@@ -9,9 +9,19 @@ License GPL-3.0-or-later: https://www.gnu.org/licenses/gpl-3.0.html
 import os
 import io
 import sys
+import mmap
+import stat
+import bisect
+import itertools
+import collections
+import multiprocessing
+import concurrent.futures
 import argparse
 import subprocess
+import time
 import asyncio
+import threading
+import logging
 import platform
 import zipfile
 
@@ -89,8 +99,10 @@ except ImportError as error:
 
 try:
     from printer_lib.models import Models, Model, isValidModel
-    from printer_lib.commander import Commander, reverse_bits
-    from printer_lib.text_print import TextCanvas
+    from printer_lib.commander import Commander
+    from printer_lib import bitmap
+    from printer_lib.text_print import TextCanvas, font_registry
+    from printer_lib.pf2cache import cache_name, load_font
 except ImportError:
     fatal(
         i18n('folder-printer_lib-is-incomplete-or-missing-please-check'),
@@ -99,36 +111,126 @@ except ImportError:
 
 # Helpers
 
-def flip(buffer, width, height, horizontally=False, vertically=True, *, overwrite=False):
-    'Flip the bitmap data'
+def flip(buffer: io.BytesIO, width, height, horizontally=False, vertically=True):
+    'Flip the bitmap data, in place'
     buffer.seek(0)
-    if not horizontally and not vertically:
-        return buffer
+    if horizontally or vertically:
+        with buffer.getbuffer() as view:
+            bitmap.flip(view, width, height, horizontally, vertically)
+    return buffer
+
+def read_pbm_header(file: io.BufferedIOBase, width):
+    ''' Read a PBM header of an image of `width` from `file`,
+        return the image height, or `None` if there's nothing more to read
+    '''
+    signature = file.readline()
+    if not signature:
+        return None
+    if signature != b'P4\n':
+        error('input-is-not-pbm-image', exception=PrinterError)
+    while True:
+        # There can be comments. Skip them
+        line = file.readline()[0:-1]
+        if line[0:1] != b'#':
+            break
+    page_width, height = map(int, line.split(b' '))
+    if page_width != width:
+        error(
+            'unsuitable-image-width-expected-0-got-1',
+            width, page_width,
+            exception=PrinterError
+        )
+    return height
+
+def is_mappable(file: io.BufferedIOBase):
+    'Whether `file` is a regular file on disk, that can be memory-mapped'
+    try:
+        return stat.S_ISREG(os.fstat(file.fileno()).st_mode)
+    except (AttributeError, OSError):
+        return False
+
+class KeptOpen(io.BufferedIOBase):
+    ''' Reads `file` as is, but leaves it open when closed,
+        so that it can be read again
+    '''
+
+    def __init__(self, file: io.BufferedIOBase):
+        super().__init__()
+        self._file = file
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self._file.seekable()
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def read1(self, size=-1):
+        return self._file.read1(size)
+
+    def readinto(self, buffer):
+        return self._file.readinto(buffer)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+def reopenable(file: io.BufferedIOBase):
+    ''' Make `file` able to be read again from current position, even after it's closed.
+        Returns `(file, reopen)`: read the returned `file` in place of the given one,
+        and call `reopen()` to get it again. `reopen` is None if it's not possible.
+        Nothing is copied for this
+    '''
+    if isinstance(file, io.BytesIO):
+        # its data is gone once closed, so don't let it be
+        position = file.tell()
+        def reopen_bytes():
+            file.seek(position)
+            return KeptOpen(file)
+        return KeptOpen(file), reopen_bytes
+    name = getattr(file, 'name', None)
+    if isinstance(name, str) and is_mappable(file):
+        position = file.tell()
+        def reopen():
+            new_file = open(name, 'rb')
+            new_file.seek(position)
+            return new_file
+        return file, reopen
+    return file, None
+
+def read_pbm(file: io.BufferedIOBase, width, buffer=4 * 1024 * 1024):
+    ''' Read PBM image data of `width` from `file` incrementally.
+        Concatenating multiple files *is* allowed.
+        `yield` every page as `(height, chunks)`, where `chunks` is a generator
+        of the page's bitmap data, in whole lines, at most `buffer` bytes each.
+        A page is skipped if going to the next one before it's consumed
+    '''
     data_width = width // 8
-    result_0 = io.BytesIO()
-    if horizontally:
-        while data := buffer.read(data_width):
-            data = bytearray(map(reverse_bits, data))
-            data.reverse()
-            result_0.write(data)
-        result_0.seek(0)
-    else:
-        result_0 = buffer
-    result_1 = io.BytesIO()
-    if vertically:
-        for i in range(height - 1, -1, -1):
-            result_0.seek(i * data_width)
-            data = result_0.read(data_width)
-            result_1.write(data)
-        result_1.seek(0)
-    else:
-        result_1 = result_0
-    buffer.seek(0)
-    if overwrite:
-        while data := result_1.read(data_width):
-            buffer.write(data)
-        buffer.seek(0)
-    return result_1
+    step = max(buffer // data_width, 1) * data_width
+    def read_page(height):
+        remain = data_width * height
+        while remain > 0:
+            size = min(step, remain)
+            chunk = file.read(size)
+            # pipes may give less than asked
+            while chunk and len(chunk) < size and (more := file.read(size - len(chunk))):
+                chunk += more
+            if len(chunk) != size:
+                error('broken-pbm-image', exception=PrinterError)
+            remain -= size
+            yield chunk
+    while (height := read_pbm_header(file, width)) is not None:
+        chunks = read_page(height)
+        yield height, chunks
+        for _ in chunks:
+            pass
 
 
 # Classes
@@ -142,10 +244,96 @@ class PrinterError(Exception):
         self.message = args[0]
         self.message_localized = i18n(*args)
 
+def read_text(text_io: io.TextIOWrapper):
+    '`yield` lines of text in `text_io`, make sure it is text'
+    while text := text_io.readline():
+        if '\x00' in text:
+            error('input-is-not-text-file', exception=PrinterError)
+        yield text
+
+def render_text(canvas: TextCanvas, text: str, batch: bytearray, used: int,
+                flip_h=False, flip_v=False):
+    ''' Lay out and rasterize `text` with `canvas` into `batch`, after `used` bytes,
+        then flip what's made as one block. `batch` grows if needed.
+        Returns the new amount of bytes used in `batch`
+    '''
+    line_size = canvas.width * canvas.height // 8
+    blank = bytes(line_size)
+    start = used
+    for line in canvas.layout(text):
+        if used + line_size > len(batch):
+            batch += bytes(used + line_size - len(batch))
+        with memoryview(batch)[used:used + line_size] as target:
+            target[:] = blank
+            canvas.rasterize(line, target)
+        used += line_size
+    if used > start and (flip_h or flip_v):
+        # flip what's made from this text, like it's a page
+        with memoryview(batch)[start:used] as block:
+            bitmap.flip(block, canvas.width, (used - start) * 8 // canvas.width, flip_h, flip_v)
+    return used
+
+def get_pf2(path: str):
+    ''' Get file io of a PF2 font in several ways
+    '''
+    path += '.pf2'
+    file = None
+    parents = ('', 'pf2/')
+    if not path:
+        path = 'unifont'
+    for parent in parents:
+        if os.path.exists(full_path := os.path.join(parent, path)):
+            file = open(full_path, 'rb')
+            break
+    else: # if didn't break
+        if os.path.exists('pf2.zip'):
+            with zipfile.ZipFile('pf2.zip') as pf2zip:
+                for name in pf2zip.namelist():
+                    if name == path:
+                        with pf2zip.open(name) as f:
+                            file = io.BytesIO(f.read())
+                        break
+    return file
+
+def get_pf2_cache(name: str, scale: int):
+    ''' Get path of precompiled cache of a PF2 font, if it's there.
+        See `printer_lib/pf2cache.py`
+    '''
+    path = cache_name(name, scale)
+    for parent in ('', 'pf2/'):
+        if os.path.exists(full_path := os.path.join(parent, path)):
+            return full_path
+    return None
+
+def load_pf2_font(family: str, scale: int):
+    ''' Load a PF2 font, from its precompiled cache if possible.
+        Used by `PrinterDriver`, and its text rendering workers
+    '''
+    file = get_pf2(family)
+    if file is None:
+        error(i18n('pf2-font-not-found-or-broken-0', family), exception=PrinterError)
+    return load_font(file, get_pf2_cache(family, scale), scale)
+
+def render_text_chunk(family: str, scale: int, width: int, options: tuple, texts: list):
+    ''' Render a chunk of `texts`, in a worker process of `PrinterDriver`.
+        `options` are `(wrap, rtl, flip_h, flip_v)`. Returns the bitmap data
+    '''
+    wrap, rtl, flip_h, flip_v = options
+    font = font_registry.get(family, scale, lambda: load_pf2_font(family, scale))
+    canvas = TextCanvas(width, wrap=wrap, rtl=rtl, font=font)
+    batch = bytearray()
+    for text in texts:
+        render_text(canvas, text, batch, len(batch), flip_h, flip_v)
+    return batch
+
 class PrinterData():
     ''' The image data to be used by `PrinterDriver`.
         Optionally give an io `file` to read PBM image data from it.
-        To read the bitmap data, simply do `io` operation with attribute `data`
+        Bitmap data is kept in a ring buffer of `max_size`: when it's full,
+        the oldest lines (and pages) are dropped, so data can be written
+        continuously. `read`, `tail`, `page` or `to_pbm` to get what's kept.
+        If `file` is a regular file on disk, it's memory-mapped instead,
+        then pages are kept as memoryviews
     '''
 
     buffer = 4 * 1024 * 1024
@@ -154,113 +342,336 @@ class PrinterData():
     'Constant width'
     _data_width: int
     'Amount of data bytes per line'
-    height: int
-    'Total height of bitmap data'
-    data: bytearray
-    'Monochrome bitmap data `io`, of size `width * height // 8`'
-    pages: list
-    'Height of every page in a `list`'
+    data: mmap.mmap = None
+    ''' Ring buffer of monochrome bitmap data, of size `max_size`.
+        Anonymous memory, made on first `write`, so it takes no space until written
+    '''
     max_size: int
-    'Max size of `data`'
-    full: bool
-    'Whether the data is full (i.e. have reached max size)'
+    'Max size of `data`, in whole lines'
+    max_height: int
+    'Max height of bitmap data kept'
+    _written: int
+    'Amount of bitmap data bytes ever written, or mapped'
+    _page_starts: collections.deque
+    'Starting line of every page kept, counting from the first line ever written'
+    _maps: list = None
+    'Memory-maps of files, if any'
+    _views: list = None
+    'Bitmap data of every page, as memoryviews to `_maps`, if mapped'
 
     def __init__(self, width, file: io.BufferedIOBase=None, max_size=64 * 1024 * 1024):
         self.width = width
         self._data_width = width // 8
-        self.height = 0
-        self.max_size = max_size
-        self.max_height = max_size // self._data_width
-        self.full = False
-        self.data = io.BytesIO()
-        self.pages = []
+        self.max_height = max(max_size // self._data_width, 1)
+        self.max_size = self.max_height * self._data_width
+        self._written = 0
+        self._page_starts = collections.deque()
         if file is not None:
             self.from_pbm(file)
 
+    @property
+    def mapped(self):
+        'Whether the data is memory-mapped from files'
+        return self._views is not None
+
+    @property
+    def full(self):
+        'Whether the data is full (i.e. have reached max size)'
+        return not self.mapped and self._written >= self.max_size
+
+    @property
+    def _first_line(self):
+        'The oldest line kept, counting from the first line ever written'
+        if self.mapped:
+            return 0
+        dropped = max(self._written - self.max_size, 0)
+        return -(-dropped // self._data_width)
+
+    @property
+    def _end_line(self):
+        'The line after the newest line kept'
+        return self._written // self._data_width
+
+    @property
+    def height(self):
+        'Total height of bitmap data kept'
+        return self._end_line - self._first_line
+
+    @property
+    def pages(self):
+        'Height of every page kept, in a `list`'
+        starts = list(self._page_starts)
+        if starts:
+            # the oldest page may be partly dropped
+            starts[0] = max(starts[0], self._first_line)
+        return [stop - start for start, stop in zip(starts, starts[1:] + [self._end_line])]
+
     def write(self, data: bytearray):
-        ''' Directly write bitmap data to `data` directly. For memory safety,
+        ''' Write bitmap data to the ring buffer. For memory safety,
             will overwrite earliest data if going to reach `max_size`.
-            returns the io position after writing.
+            Returns the amount of bytes ever written.
+        '''
+        if self.mapped:
+            raise io.UnsupportedOperation('PrinterData is memory-mapped')
+        if self.data is None:
+            self.data = mmap.mmap(-1, self.max_size)
+        if not self._page_starts:
+            self._page_starts.append(self._end_line)
+        view = memoryview(data).cast('B')
+        while view:
+            position = self._written % self.max_size
+            size = min(len(view), self.max_size - position)
+            self.data[position:position + size] = view[:size]
+            self._written += size
+            view = view[size:]
+        if self.full:
+            first = self._first_line
+            starts = self._page_starts
+            while len(starts) > 1 and starts[1] <= first:
+                starts.popleft()
+        return self._written
+
+    def _slices(self, start, stop, length=-1):
+        ''' `yield` memoryviews of bitmap data from line `start` to `stop`,
+            in chunks of at most `length` bytes, not crossing pages if mapped
         '''
-        data_len = len(data)
-        if self.data.tell() + data_len > self.max_size:
-            self.full = True
-            self.data.seek(0)
-        self.data.write(data)
-        position = self.data.tell()
-        if not self.full:
-            self.height = position // self._data_width
-        return position
+        data_width = self._data_width
+        if self.mapped:
+            starts = self._page_starts
+            index = max(bisect.bisect_right(starts, start) - 1, 0)
+            for view in itertools.islice(self._views, index, None):
+                if starts[index] >= stop:
+                    break
+                begin = (max(start, starts[index]) - starts[index]) * data_width
+                end = min((stop - starts[index]) * data_width, len(view))
+                step = length if length > 0 else max(end - begin, 1)
+                for i in range(begin, end, step):
+                    yield view[i:min(i + step, end)]
+                index += 1
+            return
+        position = start * data_width
+        end = stop * data_width
+        if position >= end:
+            return
+        view = memoryview(self.data)
+        while position < end:
+            offset = position % self.max_size
+            size = min(end - position, self.max_size - offset)
+            if length > 0:
+                size = min(size, length)
+            yield view[offset:offset + size]
+            position += size
 
     def read(self, length=-1):
-        ''' Read the bitmap data entirely, in chunks.
-            `yield` the resulting data.
-            Will finally put seek point to `0`
+        ''' Read the bitmap data entirely, from oldest to newest, in chunks.
+            `yield` the resulting data, as memoryviews.
+            Chunks don't cross the end of ring buffer, or pages if mapped
         '''
-        self.data.seek(0)
-        while chunk := self.data.read(length):
-            yield chunk
-        self.data.seek(0)
+        yield from self._slices(self._first_line, self._end_line, length)
+
+    def tail(self, lines, length=-1):
+        'Like `read`, but only the newest amount of `lines`'
+        end = self._end_line
+        yield from self._slices(max(end - lines, self._first_line), end, length)
+
+    def page(self, index, length=-1):
+        ''' Like `read`, but only the page at `index`. Negative counts from the newest.
+            Yields nothing if there's no such page, like when there's no data
+        '''
+        starts = self._page_starts
+        if not -len(starts) <= index < len(starts):
+            return
+        index %= len(starts)
+        start = max(starts[index], self._first_line)
+        stop = starts[index + 1] if index + 1 < len(starts) else self._end_line
+        yield from self._slices(start, stop, length)
+
+    def flip(self, horizontally=False, vertically=True):
+        ''' Flip the bitmap data, in place.
+            Flipping vertically also reverses order of pages
+        '''
+        if not horizontally and not vertically:
+            return
+        pages = self.pages
+        if self.mapped:
+            for view, height in zip(self._views, pages):
+                bitmap.flip(view, self.width, height, horizontally, vertically)
+            if vertically:
+                self._views.reverse()
+        else:
+            slices = list(self.read())
+            if len(slices) == 1 or not vertically:
+                for view in slices:
+                    bitmap.flip(view, self.width, len(view) // self._data_width,
+                                horizontally, vertically)
+            else:
+                # lines cross the end of ring buffer, flip a joined copy
+                flipped = bytearray().join(slices)
+                bitmap.flip(flipped, self.width, self.height, horizontally, vertically)
+                position = 0
+                for view in slices:
+                    view[:] = flipped[position:position + len(view)]
+                    position += len(view)
+        if vertically:
+            pages.reverse()
+            self._page_starts.clear()
+            line = self._first_line
+            for height in pages:
+                self._page_starts.append(line)
+                line += height
 
     def from_pbm(self, file: io.BufferedIOBase):
         ''' Read from buffer `file` that have PBM image data.
             Concatenating multiple files *is* allowed.
             Calling multiple times is also possible,
             before or after yielding `read`, not between.
-            Will put seek point to last byte written.
         '''
-        while signature := file.readline():
-            if signature != b'P4\n':
-                error('input-is-not-pbm-image', exception=PrinterError)
-            while True:
-                # There can be comments. Skip them
-                line = file.readline()[0:-1]
-                if line[0:1] != b'#':
-                    break
-            width, height = map(int, line.split(b' '))
-            if width != self.width:
-                error(
-                    'unsuitable-image-width-expected-0-got-1',
-                    self.width, width,
-                    exception=PrinterError
-                )
-            self.pages.append(height)
-            self.height += height
-            total_size = 0
-            expected_size = self._data_width * height
-            while raw_data := file.read(
-                    min(self.buffer, expected_size - total_size)):
-                total_size += len(raw_data)
-                self.write(raw_data)
-                if self.full:
-                    self.pages.pop(0)
-            if total_size != expected_size:
-                error('broken-pbm-image', exception=PrinterError)
+        if (self.mapped or self._written == 0) and is_mappable(file):
+            self._map_pbm(file)
+        else:
+            for _height, chunks in read_pbm(file, self.width, self.buffer):
+                if self.mapped:
+                    # can't be mapped, have a copy
+                    view = memoryview(b''.join(chunks))
+                    self._views.append(view)
+                    self._page_starts.append(self._end_line)
+                    self._written += len(view)
+                    continue
+                self._page_starts.append(self._end_line)
+                for raw_data in chunks:
+                    self.write(raw_data)
         if file is not sys.stdin.buffer:
             file.close()
 
+    def _map_pbm(self, file: io.BufferedIOBase):
+        ''' Memory-map PBM image data in `file`, from current position.
+            Pages are copy-on-write, so flipping them leaves the file as is
+        '''
+        if self._views is None:
+            self._maps = []
+            self._views = []
+        start = file.tell()
+        if os.fstat(file.fileno()).st_size <= start:
+            return
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        self._maps.append(mapped)
+        if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            # read once from start to end, pages behind can be dropped early
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        view = memoryview(mapped)
+        mapped.seek(start)
+        while (height := read_pbm_header(mapped, self.width)) is not None:
+            start = mapped.tell()
+            end = start + self._data_width * height
+            if end > len(mapped):
+                error('broken-pbm-image', exception=PrinterError)
+            self._views.append(view[start:end])
+            self._page_starts.append(self._end_line)
+            self._written += end - start
+            mapped.seek(end)
+
     def to_pbm(self, *, merge_pages=False):
-        ''' `yield` the pages as PBM image data,
+        ''' `yield` the pages as PBM image data, in pieces (header, then bitmap data),
             optionally just merge to one page.
-            Will restore the previous seek point.
         '''
-        pointer = self.data.tell()
-        self.data.seek(0)
         if merge_pages:
-            yield bytearray(
-                b'P4\n%i %i\n' % (self.width, self.height)
-            ) + self.data.read()
-        else:
-            for i in self.pages:
-                yield bytearray(
-                    b'P4\n%i %i\n' % (self.width, i)
-                ) + self.data.read(self._data_width * i)
-        self.data.seek(pointer)
+            yield b'P4\n%i %i\n' % (self.width, self.height)
+            yield from self.read()
+            return
+        start = self._first_line
+        for height in self.pages:
+            yield b'P4\n%i %i\n' % (self.width, height)
+            yield from self._slices(start, start + height)
+            start += height
 
     def __del__(self):
-        self.data.truncate(0)
-        self.data.close()
-        del self.data
+        if self._views is not None:
+            for view in self._views:
+                view.release()
+        for mapped in [self.data, *(self._maps or ())]:
+            if mapped is None:
+                continue
+            try:
+                mapped.close()
+            except BufferError:
+                # some views are still in use, leave it to be collected
+                pass
+
+class FlowControl():
+    ''' Adaptive pacing of data sent to printer.
+        Raises sending rate gradually, until the printer asks to pause,
+        then backs off. Wakes up as soon as the printer asks to resume.
+        Values are kept across jobs, also feel free to tune them
+    '''
+
+    rate: float = 10000.0
+    'Currently chosen sending rate, in bytes per second'
+    min_rate: float = 2000.0
+    max_rate: float = 100000.0
+    increase: float = 500.0
+    'How much the rate raises after each chunk sent without pausing'
+    decrease: float = 0.5
+    'Factor to apply to the rate when printer asks to pause'
+
+    pause_count: int = 0
+    'How many times the printer asked to pause'
+    paused_time: float = 0.0
+    'Total time spent waiting for printer to resume, in seconds'
+    bytes_sent: int = 0
+    'Total bytes sent'
+
+    listener = None
+    ''' Called with what happened: `pause`, `resume`, or `sent` (some data).
+        It's called in the driver's event loop, keep it quick
+    '''
+
+    paused: bool = False
+    _waiter: asyncio.Future = None
+
+    def _notify(self, what: str):
+        if self.listener is not None:
+            self.listener(what)
+
+    def pause(self):
+        'To be called when printer asks to pause'
+        if self.paused:
+            return
+        self.paused = True
+        self.pause_count += 1
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self._notify('pause')
+
+    def resume(self):
+        'To be called when printer asks to resume'
+        if self.paused:
+            self._notify('resume')
+        self.paused = False
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def wait(self):
+        'Wait until printer asks to resume, if paused'
+        if not self.paused:
+            return
+        start = time.perf_counter()
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+            self.paused_time += time.perf_counter() - start
+
+    async def sent(self, size: int, elapsed: float):
+        ''' To be called after sending `size` bytes, that took `elapsed` seconds.
+            Sleeps as long as the chosen rate requires
+        '''
+        self.bytes_sent += size
+        self._notify('sent')
+        if not self.paused:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+        delay = size / self.rate - elapsed
+        if delay > 0:
+            await asyncio.sleep(delay)
 
 # The driver
 
@@ -277,9 +688,28 @@ class PrinterDriver(Commander):
 
     connection_timeout : float = 5.0
 
+    reconnect_delay: float = 0.5
+    'Delay before trying to reconnect again, doubled every time, up to `max_reconnect_delay`'
+    max_reconnect_delay: float = 30.0
+    reconnect_timeout: float = 20.0
+    'How long a printing job waits for reconnecting, before giving up'
+    health_check_interval: float = 5.0
+    'Interval of checking if connection is still alive, in seconds'
+    retries: int = 2
+    'How many times a printing job is retried, from the last line sent, after connection is lost'
+
     font_family: str = 'font'
 
     text_canvas: TextCanvas = None
+    'Canvas of the last text printing job'
+    text_workers: int = 0
+    ''' Amount of processes to render text with, in chunks, for big documents.
+        0 or 1 to render in place
+    '''
+    text_chunk_lines: int = 64
+    'Amount of lines of input text, per chunk for a text worker'
+    _text_pool: concurrent.futures.ProcessPoolExecutor = None
+    _text_pool_size: int = 0
     flip_h: bool = False
     flip_v: bool = False
     wrap: bool = False
@@ -291,6 +721,16 @@ class PrinterDriver(Commander):
     speed: int = 32
 
     mtu: int = 200
+    'Size of data chunks written to printer. Will follow the connected link'
+
+    write_with_response: bool = False
+    'Whether to wait for a response of every write. Will follow the connected link'
+
+    block_lines: int = 256
+    'Amount of bitmap lines to encode at once'
+
+    stream: bool = False
+    'Print PBM data as it comes, without buffering the whole image'
 
     tx_characteristic = '0000ae01-0000-1000-8000-00805f9b34fb'
     rx_characteristic = '0000ae02-0000-1000-8000-00805f9b34fb'
@@ -304,42 +744,157 @@ class PrinterDriver(Commander):
     dump: bool = False
     'Dump traffic data, and if it\'s text printing, the resulting PBM image'
 
+    transmit_queue_size: int = 16
+    'Max amount of flushed data pieces waiting to be transmitted'
+
     _loop: asyncio.AbstractEventLoop = None
 
+    _loop_thread: threading.Thread = None
+
+    _transmit_queue: asyncio.Queue = None
+
+    _transmitter: asyncio.Task = None
+
+    _transmit_error: Exception = None
+
     _traffic_dump: io.FileIO = None
 
-    _paused: bool = False
+    flow: FlowControl = None
+    'Adaptive pacing of sending, with chosen rate and pause counts for tuning'
 
     _pending_data: io.BytesIO = None
 
+    _blank_lines: int = 0
+    'Amount of blank lines yet to be sent, as a paper feed'
+
+    _in_lattice: bool = False
+
+    rows_drawn: int = 0
+    'Total amount of bitmap lines drawn, including blank ones'
+
+    rows_sent: int = 0
+    'Total amount of bitmap lines drawn, whose data is sent to printer'
+
+    _skip_rows: int = 0
+    'Amount of bitmap lines yet to skip, when a job is retried'
+
+    _link_up: asyncio.Event = None
+
+    _connections: int = 0
+    'Amount of times connected to `device`'
+
+    _keep_connected: bool = False
+    'Whether to reconnect when connection is lost'
+
+    _reconnector: asyncio.Task = None
+
+    _health_checker: asyncio.Task = None
+
     def __init__(self):
-        self._loop = asyncio.get_event_loop_policy().new_event_loop()
+        self.flow = FlowControl()
+        self._pending_data = io.BytesIO()
 
     def loop(self, *futures):
-        ''' Run coroutines in order in current event loop until complete,
-            return its result directly, or their result as tuple.
+        ''' Run coroutines in order in the driver's own event loop (that is in its own thread)
+            until complete, return its result directly, or their result as tuple.
 
             This 1) ensures exiting gracefully (futures always get completed before exiting),
             and 2) avoids function colors (use of "await", especially outside this script)
+
+            For use in another event loop, see the coroutine (`a*`) versions of methods
         '''
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop_policy().new_event_loop()
+            self._loop_thread = threading.Thread(
+                target=self._loop.run_forever, name='PrinterDriver', daemon=True)
+            self._loop_thread.start()
+            self.loop(self._start_transmitter())
         results = []
         for future in futures:
-            results.append(self._loop.run_until_complete(future))
+            results.append(
+                asyncio.run_coroutine_threadsafe(future, self._loop).result())
         return results[0] if len(results) == 1 else tuple(results)
 
-    def connect(self, name=None, address=None):
-        ''' Connect to this device, and operate on it
+    async def _start_transmitter(self):
+        self._transmit_queue = asyncio.Queue(self.transmit_queue_size)
+        self._transmitter = asyncio.ensure_future(self._transmit())
+
+    async def _stop_transmitter(self):
+        self._transmitter.cancel()
+        try:
+            await self._transmitter
+        except asyncio.CancelledError:
+            pass
+
+    async def _write(self, data: bytes):
+        'Write `data` to printer in chunks, paced by `flow`'
+        flow = self.flow
+        for i in range(0, len(data), self.mtu):
+            chunk = data[i:i + self.mtu]
+            await flow.wait()
+            start = time.perf_counter()
+            await self.device.write_gatt_char(self.tx_characteristic, chunk,
+                                              response=self.write_with_response)
+            await flow.sent(len(chunk), time.perf_counter() - start)
+
+    async def _transmit(self):
+        ''' Keep writing flushed data to printer, in background.
+            On error, drop the rest until the error is raised to `flush`
+        '''
+        queue = self._transmit_queue
+        while True:
+            data, rows = await queue.get()
+            try:
+                if self._transmit_error is None:
+                    await self._write(data)
+                    self.rows_sent = rows
+            except Exception as e:
+                # leave out this frame, that keeps running. if it's cleared
+                # with the traceback (like `unittest` does), this task breaks
+                traceback = e.__traceback__
+                self._transmit_error = e.with_traceback(
+                    traceback.tb_next if traceback is not None else None)
+            finally:
+                queue.task_done()
+
+    async def _clear_transmit_queue(self):
+        'Drop data left in transmit queue'
+        queue = self._transmit_queue
+        while not queue.empty():
+            queue.get_nowait()
+            queue.task_done()
+
+    async def _take_transmit_error(self):
+        'Take the error that transmitter met, dropping data left in queue'
+        exc = self._transmit_error
+        if exc is not None:
+            await self._clear_transmit_queue()
+            self._transmit_error = None
+        return exc
+
+    def _raise_transmit_error(self):
+        if self._transmit_error is not None:
+            exc = self.loop(self._take_transmit_error())
+            if isinstance(exc, BaseException):
+                raise exc
+
+    async def aconnect(self, name=None, address=None):
+        ''' Connect to this device, and operate on it.
+            Coroutine version of `connect`
         '''
         self._pending_data = io.BytesIO()
         if self.fake:
             return
         if (self.device is not None and address is not None and
             (self.device.address.lower() == address.lower())):
-            return
+            # same device. if the link is lost, it's faster to reconnect
+            if self.device.is_connected or await self._wait_reconnected():
+                return
+        self._stop_keeping_connected()
         try:
             if self.device is not None and self.device.is_connected:
-                self.loop(self.device.stop_notify(self.rx_characteristic))
-                self.loop(self.device.disconnect())
+                await self.device.stop_notify(self.rx_characteristic)
+                await self.device.disconnect()
         except:     # pylint: disable=bare-except
             pass
         finally:
@@ -347,29 +902,137 @@ class PrinterDriver(Commander):
         if name is None and address is None:
             return
         self.model = Models.get(name, Models['_ZZ00'])
-        self.device = BleakClient(address)
-        def notify(_char, data):
-            if data == self.data_flow_pause:
-                self._paused = True
-            elif data == self.data_flow_resume:
-                self._paused = False
-        self.loop(
-            self.device.connect(timeout=self.connection_timeout),
-            self.device.start_notify(self.rx_characteristic, notify)
-        )
+        self.device = BleakClient(address, disconnected_callback=self._on_disconnected)
+        await self._connect_device()
+        self._start_keeping_connected()
 
-    def scan(self, identifier: str=None, *, use_result=False, everything=False):
-        ''' Scan for supported devices, optionally filter with `identifier`,
-            which can be device model (bluetooth name), and optionally MAC address, after a comma.
-            If `use_result` is True, connect to the first available device to driver instantly.
-            If `everything` is True, return all bluetooth devices found.
-            Note: MAC address doesn't work on Apple MacOS. In place with it,
-            You need an UUID of BLE device dynamically given by MacOS.
+    def connect(self, name=None, address=None):
+        ''' Connect to this device, and operate on it
+        '''
+        self.loop(self.aconnect(name, address))
+
+    def _on_notify(self, _char, data):
+        if data == self.data_flow_pause:
+            self.flow.pause()
+        elif data == self.data_flow_resume:
+            self.flow.resume()
+
+    async def _connect_device(self):
+        'Connect to `device`, and prepare to operate on it'
+        await self.device.connect(timeout=self.connection_timeout)
+        await self.device.start_notify(self.rx_characteristic, self._on_notify)
+        await self._setup_writing()
+        self._connections += 1
+
+    def _start_keeping_connected(self):
+        ''' Keep the connection: check it from time to time,
+            and reconnect in background if it's lost. Call in the event loop
+        '''
+        self._keep_connected = True
+        if self._link_up is None:
+            self._link_up = asyncio.Event()
+        self._link_up.set()
+        if self._health_checker is None:
+            self._health_checker = asyncio.ensure_future(self._check_health())
+
+    def _stop_keeping_connected(self):
+        self._keep_connected = False
+        for task in (self._reconnector, self._health_checker):
+            if task is not None:
+                task.cancel()
+        self._reconnector = self._health_checker = None
+
+    def _on_disconnected(self, client: BleakClient):
+        'Called (by Bleak) when the device is disconnected'
+        if client is self.device and not client.is_connected:
+            self._link_lost()
+
+    def _link_lost(self):
+        'Connection is (or seems) lost. Reconnect in background, if not yet'
+        if not self._keep_connected:
+            return
+        self._link_up.clear()
+        # let data waiting to be sent go on, to fail
+        self.flow.resume()
+        if self._reconnector is None or self._reconnector.done():
+            self._reconnector = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self):
+        'Reconnect to `device` until done, waiting a bit longer after every failure'
+        delay = self.reconnect_delay
+        while True:
+            try:
+                if self.device.is_connected:
+                    # the link is broken anyway. start over
+                    await self.device.disconnect()
+                await self._connect_device()
+                break
+            except (BleakError, EOFError, OSError, asyncio.TimeoutError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+        self._link_up.set()
+
+    async def _check_health(self):
+        'Find out if connection is lost, in case it\'s not told'
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            if self._link_up.is_set() and not self.device.is_connected:
+                self._link_lost()
+
+    async def _wait_reconnected(self, connections: int=None):
+        ''' Reconnect if not yet, and wait for it at most `reconnect_timeout`.
+            If the link failed while it's the `connections`th one, a newer one is fine.
+            Returns whether it's connected
+        '''
+        if not self._keep_connected:
+            return False
+        if not (connections is not None and self._connections > connections
+                and self._link_up.is_set() and self.device.is_connected):
+            self._link_lost()
+        try:
+            await asyncio.wait_for(self._link_up.wait(), self.reconnect_timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _setup_writing(self):
+        ''' Decide how to write data, by what the connected link supports:
+            write without response if possible, in chunks of negotiated MTU
+        '''
+        self.mtu = PrinterDriver.mtu
+        self.write_with_response = PrinterDriver.write_with_response
+        characteristic = self.device.services.get_characteristic(self.tx_characteristic)
+        if characteristic is None:
+            return
+        if 'write-without-response' not in characteristic.properties:
+            self.write_with_response = True
+        # BlueZ reports the default 23 bytes MTU, before it's acquired.
+        # `_acquire_mtu` is private to the BlueZ backend, checked against bleak 3.0.2
+        acquire_mtu = getattr(self.device._backend, '_acquire_mtu', None)    # pylint: disable=protected-access
+        if acquire_mtu is not None:
+            try:
+                await acquire_mtu()
+            except (BleakError, EOFError):
+                pass
+        else:
+            logging.getLogger(__name__).debug(
+                'No _acquire_mtu in %s, using the MTU it reports',
+                type(self.device._backend).__name__)    # pylint: disable=protected-access
+        if self.write_with_response:
+            size = self.device.mtu_size - 3
+        else:
+            size = characteristic.max_write_without_response_size
+        # still the default, the real one is unknown. keep ours
+        if size > 20:
+            self.mtu = min(size, 512)
+
+    async def ascan(self, identifier: str=None, *, use_result=False, everything=False):
+        ''' Scan for supported devices. Coroutine version of `scan`
         '''
         if self.fake:
             return []
         if everything:
-            devices = self.loop(BleakScanner.discover(self.scan_time))
+            devices = await BleakScanner.discover(self.scan_time)
             return devices
         if identifier:
             if identifier.find(',') != -1:
@@ -380,14 +1043,14 @@ class PrinterDriver(Commander):
                 if address[2::3] != ':::::' and len(address.replace('-', '')) != 32:
                     error('invalid-address-0', address, exception=PrinterError)
                 if use_result:
-                    self.connect(name, address)
-                return [BLEDevice(address, name)]
+                    await self.aconnect(name, address)
+                return [BLEDevice(address, name, None)]
             if (not isValidModel(identifier) and
                 identifier[2::3] != ':::::' and len(identifier.replace('-', '')) != 32):
                 error('model-0-is-not-supported-yet', identifier, exception=PrinterError)
         # scanner = BleakScanner()
-        devices = [x for x in self.loop(
-            BleakScanner.discover(self.scan_time)
+        devices = [x for x in (
+            await BleakScanner.discover(self.scan_time)
         ) if isValidModel(x.name)]
         if identifier:
             if isValidModel(identifier):
@@ -395,45 +1058,213 @@ class PrinterDriver(Commander):
             else:
                 devices = [dev for dev in devices if dev.address.lower() == identifier.lower()]
         if use_result and len(devices) != 0:
-            self.connect(devices[0].name, devices[0].address)
+            await self.aconnect(devices[0].name, devices[0].address)
         return devices
 
+    def scan(self, identifier: str=None, *, use_result=False, everything=False):
+        ''' Scan for supported devices, optionally filter with `identifier`,
+            which can be device model (bluetooth name), and optionally MAC address, after a comma.
+            If `use_result` is True, connect to the first available device to driver instantly.
+            If `everything` is True, return all bluetooth devices found.
+            Note: MAC address doesn't work on Apple MacOS. In place with it,
+            You need an UUID of BLE device dynamically given by MacOS.
+        '''
+        return self.loop(self.ascan(identifier, use_result=use_result, everything=everything))
+
     def print(self, file: io.BufferedIOBase, *, mode='default',
-              identifier: str=None):
+              identifier: str=None, cancel: threading.Event=None):
         ''' Print data of `file`.
             Currently, available modes are `pbm` and `text`.
             If no devices were connected, scan & connect to one first.
+            Set `cancel` (from another thread) to stop printing midway:
+            data waiting to be sent is dropped, then the printer ends printing
+            and feeds paper, as usual. Returns False if cancelled.
+            If connection is lost, reconnect and retry from the last line sent,
+            at most `retries` times, if `file` can be read again
         '''
-        self._pending_data = io.BytesIO()
         if self.device is None:
             self.scan(identifier, use_result=True)
+        elif self._link_up is not None and not self._link_up.is_set():
+            # reconnecting in background. it's the fastest way
+            if not self.loop(self._wait_reconnected()):
+                raise BleakError('Connection to printer is lost, and not back in time')
+        original, reopen = file, None
+        if self.retries > 0 and not self.fake:
+            file, reopen = reopenable(file)
+        # what's drawn but not sent by a failed job is gone
+        start = self.rows_drawn = self.rows_sent
+        retries = self.retries
+        try:
+            while True:
+                connections = self._connections
+                try:
+                    return self._run(self._make_job(file, mode), cancel)
+                except (BleakError, EOFError):
+                    # it may be reconnected in background already
+                    if (retries == 0 or reopen is None or
+                            (cancel is not None and cancel.is_set()) or
+                            not self.loop(self._wait_reconnected(connections))):
+                        raise
+                    retries -= 1
+                file = reopen()
+                self.rows_drawn = self.rows_sent
+                self._skip_rows = self.rows_sent - start
+        finally:
+            self._skip_rows = 0
+            if isinstance(file, KeptOpen):
+                original.close()
+
+    async def aprint(self, file: io.BufferedIOBase, *, mode='default',
+                     identifier: str=None):
+        ''' Print data of `file`. Coroutine version of `print`.
+            If cancelled while printing, data being sent still gets sent,
+            then the printer ends printing and feeds paper, as usual
+        '''
+        if self.device is None:
+            await self.ascan(identifier, use_result=True)
+        await self._arun(self._make_job(file, mode))
+
+    def _make_job(self, file: io.BufferedIOBase, mode: str):
+        ''' Make a printing job, that is a generator making commands,
+            and yielding whenever it's a good point to flush,
+            `True` if pending data should be flushed right now
+        '''
+        self._pending_data = io.BytesIO()
         if self.device is None and not self.fake:
             error('no-available-devices-found', exception=PrinterError)
         if mode in ('pbm', 'default'):
+            if self.stream:
+                return self._print_bitmap_stream(file)
             printer_data = PrinterData(self.model.paper_width, file)
-            self._print_bitmap(printer_data)
-        elif mode == 'text':
-            self._print_text(file)
-        else:
-            ... # TODO: other?
+            return self._print_bitmap(printer_data)
+        if mode == 'text':
+            return self._print_text(file)
+        # TODO: other?
+        return iter(())
+
+    def _run(self, job, cancel: threading.Event=None):
+        for force in job:
+            if cancel is not None and cancel.is_set():
+                self._cancel_job(job, self._in_lattice)
+                return False
+            if force or self._pending_data.tell() > self.mtu * 16:
+                if not self.flush(cancel):
+                    self._cancel_job(job, self._in_lattice)
+                    return False
+        if cancel is not None and self._loop is not None:
+            if not (self.flush(cancel) and
+                    self.loop(self._until_cancelled(self._transmit_queue.join(), cancel))):
+                # the end of printing is dropped with data left. do it again
+                self._cancel_job(job, True)
+                return False
+        self.drain()
+        return True
+
+    def _cancel_job(self, job, in_lattice: bool):
+        job.close()
+        if self._loop is not None:
+            self.loop(self._clear_transmit_queue())
+        # what's pending are whole commands. just drop them
+        self._pending_data = io.BytesIO()
+        if in_lattice:
+            self._blank_lines = 0
+            self._finish()
+        self.drain()
+
+    async def _until_cancelled(self, coroutine, cancel: threading.Event):
+        'Await `coroutine`, unless `cancel` is set before it\'s done. Returns False if so'
+        task = asyncio.ensure_future(coroutine)
+        while not cancel.is_set():
+            done, _ = await asyncio.wait((task, ), timeout=0.1)
+            if done:
+                task.result()
+                return True
+        task.cancel()
+        return False
+
+    async def _arun(self, job):
+        try:
+            for force in job:
+                if force or self._pending_data.tell() > self.mtu * 16:
+                    await self.aflush()
+            await self.aflush()
+        except asyncio.CancelledError:
+            job.close()
+            if self._in_lattice:
+                # what's pending are whole commands. just drop them
+                self._pending_data = io.BytesIO()
+                self._blank_lines = 0
+                self._finish()
+                await self.aflush()
+            raise
 
-    def flush(self):
-        'Send pending data instantly, but will block if paused'
-        self._pending_data.seek(0)
-        while chunk := self._pending_data.read(self.mtu):
-            while self._paused:
-                self.loop(asyncio.sleep(0.2))
-            self.loop(
-                self.device.write_gatt_char(self.tx_characteristic, chunk),
-                asyncio.sleep(0.02)
-            )
+    def flush(self, cancel: threading.Event=None):
+        ''' Pass pending data to be sent in background, instantly.
+            Will block if there's already much data waiting to be sent,
+            unless `cancel` is set meanwhile. Returns False if so, and the data is dropped
+        '''
+        data = self._take_pending_data()
+        if data:
+            putting = self._transmit_queue.put((data, self._rows_pended()))
+            if cancel is None:
+                self.loop(putting)
+            elif not self.loop(self._until_cancelled(putting, cancel)):
+                return False
+        elif self.fake:
+            self.rows_sent = self._rows_pended()
+        self._raise_transmit_error()
+        return True
+
+    def drain(self):
+        'Flush, and block until all pending data is sent'
+        self.flush()
+        if self._loop is not None:
+            self.loop(self._transmit_queue.join())
+        self._raise_transmit_error()
+
+    async def aflush(self):
+        ''' Send pending data instantly, and wait until it's sent.
+            Coroutine version of `flush` & `drain`, in the running event loop.
+            If cancelled, data being sent still gets sent, so no command is left cut
+        '''
+        data = self._take_pending_data()
+        if not data:
+            if self.fake:
+                self.rows_sent = self._rows_pended()
+            return
+        rows = self._rows_pended()
+        writing = asyncio.ensure_future(self._write(data))
+        try:
+            await asyncio.shield(writing)
+        except asyncio.CancelledError:
+            await writing
+            raise
+        finally:
+            # `exception()` raises if it's cancelled, hiding the error being raised
+            if writing.done() and not writing.cancelled() and writing.exception() is None:
+                self.rows_sent = rows
+
+    async def asend(self, data):
+        ''' Pend `data`, send if enough size is reached.
+            Coroutine version of `send`, that sends by itself
+        '''
+        self.send(data)
+        if self._pending_data.tell() > self.mtu * 16:
+            await self.aflush()
+
+    def _rows_pended(self):
+        'Amount of bitmap lines, whose data is all pended (or sent)'
+        return self.rows_drawn - self._blank_lines
+
+    def _take_pending_data(self):
+        data = self._pending_data.getvalue()
         self._pending_data.seek(0)
         self._pending_data.truncate()
+        return data
 
     def send(self, data):
-        ''' Pend `data`, send if enough size is reached.
-            You can manually `flush` to send data instantly,
-            and should do `flush` at the end of printing.
+        ''' Pend `data`, to be sent on next `flush`.
+            Should do `drain` at the end of printing.
         '''
         if self.dump:
             if self._traffic_dump is None:
@@ -442,8 +1273,6 @@ class PrinterDriver(Commander):
         if self.fake:
             return
         self._pending_data.write(data)
-        if self._pending_data.tell() > self.mtu * 16 and not self._paused:
-            self.flush()
 
     def _prepare(self):
         self.get_device_state()
@@ -458,65 +1287,127 @@ class PrinterDriver(Commander):
             self.set_energy(self.energy)
         self.apply_energy()
         self.update_device()
-        self.flush()
+        yield True
         self.start_lattice()
+        self._in_lattice = True
+        self._blank_lines = 0
 
     def _finish(self):
+        self._feed_blank_lines()
         self.end_lattice()
+        self._in_lattice = False
         self.set_speed(8)
         if self.model.problem_feeding:
-            for _ in range(128):
-                self.draw_bitmap(bytes(self.model.paper_width // 8))
+            line_width = self.model.paper_width // 8
+            self.draw_bitmap_lines(bytes(line_width * 128), line_width)
         else:
             self.feed_paper(128)
         self.get_device_state()
-        self.flush()
+
+    def _feed_blank_lines(self):
+        'Send pending blank lines, as paper feed, at most 255 pixels at a time'
+        while self._blank_lines > 0:
+            pixels = min(self._blank_lines, 0xff)
+            self.feed_paper(pixels)
+            self._blank_lines -= pixels
+
+    def _draw_bitmap_lines(self, bitmap_data: bytearray):
+        ''' Draw lines of `bitmap_data`, in the best way the model can understand.
+            Blank lines are pended, to be sent as one paper feed command
+        '''
+        line_width = self.model.paper_width // 8
+        # slices of a memoryview are not copies, mmap chunks go to encoders as-is
+        data = memoryview(bitmap_data).cast('B')
+        if self._skip_rows > 0:
+            # these are printed before retrying
+            skip = min(self._skip_rows, len(data) // line_width)
+            self._skip_rows -= skip
+            data = data[skip * line_width:]
+        self.rows_drawn += len(data) // line_width
+        if self.dry_run:
+            data = memoryview(bytes(len(data)))
+        if self.model.problem_feeding:
+            self._draw_bitmap_lines_directly(data)
+            return
+        blank = bytes(line_width)
+        # start of lines that are not blank
+        start = 0
+        for i in range(0, len(data), line_width):
+            if data[i:i + line_width] != blank:
+                continue
+            if start != i:
+                self._feed_blank_lines()
+                self._draw_bitmap_lines_directly(data[start:i])
+            self._blank_lines += 1
+            start = i + line_width
+        if start != len(data):
+            self._feed_blank_lines()
+            self._draw_bitmap_lines_directly(data[start:])
+
+    def _draw_bitmap_lines_directly(self, bitmap_data: bytearray):
+        line_width = self.model.paper_width // 8
+        if self.model.is_new_kind:
+            self.draw_compressed_bitmap_lines(bitmap_data, line_width)
+        else:
+            self.draw_bitmap_lines(bitmap_data, line_width)
 
     def _print_bitmap(self, data: PrinterData):
         paper_width = self.model.paper_width
-        flip(data.data, data.width, data.height, self.flip_h, self.flip_v, overwrite=True)
-        self._prepare()
-        # TODO: consider compression on new devices
-        for chunk in data.read(paper_width // 8):
-            if self.dry_run:
-                chunk = b'\x00' * len(chunk)
-            self.draw_bitmap(chunk)
+        data.flip(self.flip_h, self.flip_v)
+        yield from self._prepare()
+        for chunk in data.read(paper_width // 8 * self.block_lines):
+            self._draw_bitmap_lines(chunk)
+            yield False
         if self.dump:
             with open('dump.pbm', 'wb') as dump_pbm:
-                dump_pbm.write(next(data.to_pbm(merge_pages=True)))
+                dump_pbm.writelines(data.to_pbm(merge_pages=True))
         self._finish()
 
-    def _get_pf2(self, path: str):
-        ''' Get file io of a PF2 font in several ways
-        '''
-        path += '.pf2'
-        file = None
-        parents = ('', 'pf2/')
-        if not path:
-            path = 'unifont'
-        for parent in parents:
-            if os.path.exists(full_path := os.path.join(parent, path)):
-                file = open(full_path, 'rb')
-                break
-        else: # if didn't break
-            if os.path.exists('pf2.zip'):
-                with zipfile.ZipFile('pf2.zip') as pf2zip:
-                    for name in pf2zip.namelist():
-                        if name == path:
-                            with pf2zip.open(name) as f:
-                                file = io.BytesIO(f.read())
-                            break
-        return file
+    def _print_bitmap_stream(self, file: io.BufferedIOBase):
+        paper_width = self.model.paper_width
+        line_width = paper_width // 8
+        pages = read_pbm(file, paper_width, line_width * self.block_lines)
+        # check the input before starting
+        page = next(pages, None)
+        yield from self._prepare()
+        dump_pbm = open('dump.pbm', 'wb') if self.dump else None
+        try:
+            while page is not None:
+                height, chunks = page
+                if dump_pbm is not None:
+                    dump_pbm.write(b'P4\n%i %i\n' % (paper_width, height))
+                if self.flip_v:
+                    # flipping vertically needs the whole page
+                    buffer = io.BytesIO()
+                    for chunk in chunks:
+                        buffer.write(chunk)
+                    flip(buffer, paper_width, height, self.flip_h, self.flip_v)
+                    chunks = iter(lambda: buffer.read(line_width * self.block_lines), b'')
+                for chunk in chunks:
+                    if self.flip_h and not self.flip_v:
+                        chunk = bytearray(chunk)
+                        bitmap.flip(chunk, paper_width, len(chunk) // line_width, True, False)
+                    if dump_pbm is not None:
+                        dump_pbm.write(chunk)
+                    self._draw_bitmap_lines(chunk)
+                    yield False
+                page = next(pages, None)
+        finally:
+            if dump_pbm is not None:
+                dump_pbm.close()
+            if file is not sys.stdin.buffer:
+                file.close()
+        self._finish()
 
     def _print_text(self, file: io.BufferedIOBase):
         paper_width = self.model.paper_width
         text_io = io.TextIOWrapper(file, encoding='utf-8')
-        if self.text_canvas is None:
-            self.text_canvas = TextCanvas(paper_width, wrap=self.wrap,
-                    rtl=self.rtl, font_path=self.font_family + '.pf2',
-                    font_data_io=self._get_pf2(self.font_family), scale=self.font_scale)
-            if self.text_canvas.broken:
-                error(i18n('pf2-font-not-found-or-broken-0', self.font_family), exception=PrinterError)
+        family, scale = self.font_family, self.font_scale
+        # fonts are shared, while the canvas follows current options
+        font = font_registry.get(family, scale, lambda: load_pf2_font(family, scale))
+        self.text_canvas = TextCanvas(paper_width, wrap=self.wrap, rtl=self.rtl, font=font)
+        if self.text_canvas.broken:
+            error(i18n('pf2-font-not-found-or-broken-0', family), exception=PrinterError)
         # with stdin you maybe trying out a typewriter
         # so print a "ruler", indicating max characters in one line
         if file is sys.stdin.buffer:
@@ -538,49 +1429,105 @@ class PrinterDriver(Commander):
             # ruler
             info('-------+' * (paper_width // average // 8) +
                     '-' * (paper_width // average % 8))
-        self._prepare()
-        printer_data = PrinterData(paper_width)
-        buffer = io.BytesIO()
+        yield from self._prepare()
+        canvas = self.text_canvas
+        batch_size = paper_width // 8 * self.block_lines
+        # rendered lines go here, then sent in batches. reused, grows if needed
+        batch = bytearray(batch_size)
+        used = 0
+        printer_data = PrinterData(paper_width) if self.dump else None
+        # type a line, print a line
+        typewriter = file is sys.stdin.buffer
         try:
-            while line := text_io.readline():
-                if '\x00' in line:
-                    error('input-is-not-text-file', exception=PrinterError)
-                line_count = 0
-                for data in self.text_canvas.puttext(line):
-                    buffer.write(data)
-                    line_count += 1
-                flip(buffer, self.text_canvas.width, self.text_canvas.height * line_count,
-                        self.flip_h, self.flip_v, overwrite=True)
-                while chunk := buffer.read(paper_width // 8):
-                    printer_data.write(chunk)
-                    if self.dry_run:
-                        chunk = b'\x00' * len(chunk)
-                    self.draw_bitmap(chunk)
-                buffer.seek(0)
-                buffer.truncate()
-                self.flush()
+            if self.text_workers > 1 and not typewriter:
+                for data in self._render_text_parallel(read_text(text_io), paper_width):
+                    self._draw_text_batch(data, len(data), printer_data)
+                    yield False
+            else:
+                for text in read_text(text_io):
+                    used = render_text(canvas, text, batch, used, self.flip_h, self.flip_v)
+                    if typewriter or used >= batch_size:
+                        self._draw_text_batch(batch, used, printer_data)
+                        used = 0
+                        yield typewriter
         except UnicodeDecodeError:
             error('input-is-not-text-file', exception=PrinterError)
-        if self.dump:
+        self._draw_text_batch(batch, used, printer_data)
+        if printer_data is not None:
             with open('dump.pbm', 'wb') as dump_pbm:
-                dump_pbm.write(next(printer_data.to_pbm(merge_pages=True)))
+                dump_pbm.writelines(printer_data.to_pbm(merge_pages=True))
         self._finish()
 
-    def unload(self):
-        ''' Unload this instance, disconnect device and clean up.
+    def _render_text_parallel(self, texts, width):
+        ''' Render `texts` in chunks with the process pool, `yield` the results in order.
+            At most about twice the amount of workers are rendered ahead
         '''
+        if self._text_pool is None or self._text_pool_size != self.text_workers:
+            self._stop_text_pool()
+            # don't fork, there's a thread running event loop
+            self._text_pool = concurrent.futures.ProcessPoolExecutor(
+                self.text_workers, mp_context=multiprocessing.get_context('spawn'))
+            self._text_pool_size = self.text_workers
+        arguments = (self.font_family, self.font_scale, width,
+                     (self.wrap, self.rtl, self.flip_h, self.flip_v))
+        window = collections.deque()
+        try:
+            for chunk in iter(lambda: list(itertools.islice(texts, self.text_chunk_lines)), []):
+                window.append(self._text_pool.submit(render_text_chunk, *arguments, chunk))
+                if len(window) > self.text_workers * 2:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+        finally:
+            for future in window:
+                future.cancel()
+
+    def _stop_text_pool(self):
+        if self._text_pool is not None:
+            self._text_pool.shutdown(cancel_futures=True)
+            self._text_pool = None
+
+    def _draw_text_batch(self, batch: bytearray, size: int, printer_data: PrinterData=None):
+        'Draw the first `size` bytes of rendered text in `batch`, keep a copy to `printer_data`'
+        if size == 0:
+            return
+        with memoryview(batch)[:size] as data:
+            self._draw_bitmap_lines(data)
+            if printer_data is not None:
+                printer_data.write(data)
+
+    async def _disconnect(self):
+        self._stop_keeping_connected()
         if self.device is not None:
             info(i18n('disconnecting-from-printer'))
             try:
-                self.loop(
-                    self.device.stop_notify(self.rx_characteristic),
-                    self.device.disconnect()
-                )
+                await self.device.stop_notify(self.rx_characteristic)
+                await self.device.disconnect()
             except (BleakError, EOFError):
                 self.device = None
+
+    def unload(self):
+        ''' Unload this instance, disconnect device and clean up.
+        '''
+        if self.device is not None:
+            self.loop(self._disconnect())
+        if self._traffic_dump is not None:
+            self._traffic_dump.close()
+        self._stop_text_pool()
+        if self._loop is not None:
+            self.loop(self._stop_transmitter())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop.close()
+
+    async def aunload(self):
+        ''' Unload this instance, disconnect device and clean up.
+            Coroutine version of `unload`, for when connected via `aconnect`
+        '''
+        await self._disconnect()
         if self._traffic_dump is not None:
             self._traffic_dump.close()
-        self._loop.close()
+        self._stop_text_pool()
 
 # CLI procedure
 
@@ -668,9 +1615,9 @@ def _main():
             help=i18n('scan-for-a-printer'))
     parser.add_argument('-c', '--convert', metavar='text|image', type=str, default='',
             help=i18n('convert-input-image-with-imagemagick'))
-    parser.add_argument('-p', '--image', metavar='flip|fliph|flipv', type=str, default='',
+    parser.add_argument('-p', '--image', metavar='flip|fliph|flipv[,stream]', type=str, default='',
             help=i18n('image-printing-options'))
-    parser.add_argument('-t', '--text', metavar='Size[,FontFamily][,pf2][,nowrap][,rtl]', type=str,
+    parser.add_argument('-t', '--text', metavar='Size[,FontFamily][,pf2][,nowrap][,rtl][,parallel]', type=str,
             default='', help=i18n('text-printing-mode-with-options'))
     parser.add_argument('-e', '--energy', metavar='0.0-1.0', type=float, default=None,
             help=i18n('control-printer-thermal-strength'))
@@ -717,6 +1664,7 @@ def _main():
         printer.flip_h = True
     elif 'flipv' in image_param:
         printer.flip_v = True
+    printer.stream = 'stream' in image_param
 
     if args.text:
         text_param = args.text.split(',')
@@ -724,6 +1672,8 @@ def _main():
         font_family = text_param[1] if len(text_param) > 1 else None
         printer.wrap = 'nowrap' not in text_param
         printer.rtl = 'rtl' in text_param
+        if 'parallel' in text_param:
+            printer.text_workers = os.cpu_count() or 1
 
     info(i18n('cat-printer'))
 
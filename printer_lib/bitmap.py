@@ -0,0 +1,87 @@
+'''
+Transforms of monochrome bitmap data, the kind cat printers use:
+1 bit per pixel, most significant bit first, `width // 8` bytes per line.
+
+All operations work in place, on any writable buffer
+(`bytearray`, `memoryview`, `io.BytesIO.getbuffer()` ...).
+NumPy is used if available, otherwise falls back to pure Python.
+
+No rights reserved.
+License CC0-1.0-only: https://directory.fsf.org/wiki/License:CC0
+'''
+
+from .commander import reverse_bits_table
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def _view(data, width, height):
+    'Byte `memoryview` of the first `height` lines in `data`'
+    return memoryview(data).cast('B')[:width // 8 * height]
+
+def _lines(view, width, height):
+    'NumPy array of `view`, one row per line'
+    return numpy.frombuffer(view, dtype=numpy.uint8).reshape(height, width // 8)
+
+def reverse(data):
+    'Reverse the bits of every byte in `data`'
+    view = memoryview(data).cast('B')
+    view[:] = view.tobytes().translate(reverse_bits_table)
+
+def flip(data, width, height, horizontally=False, vertically=True):
+    'Flip the bitmap `data` of size `width` x `height`'
+    if not horizontally and not vertically:
+        return
+    view = _view(data, width, height)
+    if numpy is not None:
+        lines = _lines(view, width, height)
+        if horizontally:
+            step = -1 if vertically else 1
+            view[:] = lines[::step, ::-1].tobytes().translate(reverse_bits_table)
+        else:
+            lines[:] = lines[::-1]
+        return
+    line = width // 8
+    if horizontally:
+        # reversing all bytes flips both ways at once
+        view[:] = view.tobytes()[::-1].translate(reverse_bits_table)
+        vertically = not vertically
+    if vertically:
+        flat = view.tobytes()
+        view[:] = b''.join([
+            flat[i:i + line] for i in range(len(flat) - line, -1, -line)
+        ])
+
+def rotate(data, width, height, clockwise=True):
+    ''' Rotate the bitmap `data` of size `width` x `height` by 90 degrees.
+        `height` should be a multiple of 8, as it becomes the new width.
+        Returns the new `(width, height)`
+    '''
+    if height % 8 != 0:
+        raise ValueError(f'Bitmap height {height} is not a multiple of 8')
+    view = _view(data, width, height)
+    if numpy is not None:
+        bits = numpy.unpackbits(_lines(view, width, height), axis=1)
+        bits = numpy.rot90(bits, -1 if clockwise else 1)
+        view[:] = numpy.packbits(bits, axis=1).tobytes()
+        return height, width
+    line = width // 8
+    flat = view.tobytes()
+    rows = [
+        format(int.from_bytes(flat[i:i + line], 'big'), f'0{width}b')
+        for i in range(0, len(flat), line)
+    ]
+    if clockwise:
+        # new lines are old columns, from bottom to top
+        rows.reverse()
+        columns = zip(*rows)
+    else:
+        # new lines are old columns from right to left, from top to bottom
+        columns = reversed(list(zip(*rows)))
+    new_line = height // 8
+    view[:] = b''.join([
+        int(''.join(column), 2).to_bytes(new_line, 'big') for column in columns
+    ])
+    return height, width
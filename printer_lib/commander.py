@@ -6,6 +6,8 @@ License CC0-1.0-only: https://directory.fsf.org/wiki/License:CC0
 '''
 
 from abc import ABCMeta, abstractmethod
+from itertools import cycle
+from operator import getitem
 
 crc8_table = [
     0x00, 0x07, 0x0e, 0x09, 0x1c, 0x1b, 0x12, 0x15, 0x38, 0x3f, 0x36, 0x31,
@@ -39,12 +41,57 @@ def crc8(data):
         crc = crc8_table[(crc ^ byte) & 0xff]
     return crc & 0xff
 
+def _make_crc8_tail_tables():
+    ''' The checksum is linear, so it's the xor of what every byte contributes.
+        `tables[n][byte]` is `crc8` of `byte` followed by `n` zero bytes
+    '''
+    tables = [bytes(crc8_table)]
+    for _ in range(0xff):
+        tables.append(tables[-1].translate(tables[0]))
+    return tables
+
+crc8_tail_tables = _make_crc8_tail_tables()
+'Translation tables for computing `crc8` of many same-sized payloads at once'
+
 def reverse_bits(i: int):
     'Reverse the bits of this byte (as `int`)'
     i = ((i & 0b10101010) >> 1) | ((i & 0b01010101) << 1)
     i = ((i & 0b11001100) >> 2) | ((i & 0b00110011) << 2)
     return ((i & 0b11110000) >> 4) | ((i & 0b00001111) << 4)
 
+reverse_bits_table = bytes(map(reverse_bits, range(256)))
+'Translation table of `reverse_bits`, for use with `bytes.translate`'
+
+def _encode_run(color: int, length: int):
+    result = bytearray()
+    while length > 0x7f:
+        result.append(color | 0x7f)
+        length -= 0x7f
+    result.append(color | length)
+    return bytes(result)
+
+_run_codes = tuple([_encode_run(color, length) for length in range(1, 0xff * 8 + 1)]
+                   for color in (0x00, 0x80))
+'Encoded runs of white & black pixels, by length minus 1, up to a line of 255 bytes'
+
+def compress_bitmap_line(bitmap_data: bytearray, max_size: int=None) -> bytes:
+    ''' Run-length encode a line of bitmap, as new kind of printers understand.
+        Every byte is a run of up to 127 pixels, highest bit being the color.
+        Gives up and returns `None` if the result would reach `max_size`
+    '''
+    width = len(bitmap_data) * 8
+    value = int.from_bytes(bitmap_data, 'big')
+    # a run starts at the first pixel, and at every color change
+    starts = format(value ^ (value >> 1) | (1 << (width - 1)), f'0{width}b')
+    if max_size is not None and starts.count('1') >= max_size:
+        return None
+    # colors of runs take turns, from that of the first pixel
+    colors = _run_codes[::-1] if value >> (width - 1) else _run_codes
+    result = b''.join(map(getitem, cycle(colors), map(len, starts.split('1')[1:])))
+    if max_size is not None and len(result) >= max_size:
+        return None
+    return result
+
 def int_to_bytes(i: int, length=1, big_endian=False) -> bytes:
     max_value = (1 << (length * 8)) - 1
     if type(i) is not int:
@@ -148,14 +195,74 @@ class Commander(metaclass=ABCMeta):
         '''
         self.send( self.make_command(0xaf, int_to_bytes(amount, length=2)) )
 
+    def make_bitmap_commands(self, bitmap_data: bytearray, line_width: int):
+        ''' Make `draw_bitmap` commands of every line in `bitmap_data`,
+            each `line_width` bytes, into one buffer.
+            Works column by column, so Python-level loops don't grow with line count
+        '''
+        if line_width > 0xff:
+            raise ValueError(f'Command payload too big ({line_width} > 255)')
+        view = memoryview(bitmap_data).cast('B')
+        lines, remain = divmod(len(view), line_width)
+        if remain != 0:
+            raise ValueError(f'Bitmap data size {len(view)} is not a multiple of {line_width}')
+        data = view.tobytes().translate(reverse_bits_table)
+        stride = line_width + 8
+        result = bytearray(stride * lines)
+        for i, byte in enumerate([ 0x51, 0x78, 0xa2, 0x00, line_width, 0x00 ]):
+            result[i::stride] = bytes((byte, )) * lines
+        crc = 0
+        for i in range(line_width):
+            column = data[i::line_width]
+            result[6 + i::stride] = column
+            crc ^= int.from_bytes(
+                column.translate(crc8_tail_tables[line_width - 1 - i]), 'big')
+        result[6 + line_width::stride] = crc.to_bytes(lines, 'big')
+        result[7 + line_width::stride] = b'\xff' * lines
+        return result
+
     def draw_bitmap(self, bitmap_data: bytearray):
         'Print `bitmap_data`. Also does the bit-reversing job.'
-        data = bytearray( map(reverse_bits, bitmap_data) )
+        data = bytes(bitmap_data).translate(reverse_bits_table)
         self.send( self.make_command(0xa2, data) )
 
+    def draw_bitmap_lines(self, bitmap_data: bytearray, line_width: int):
+        ''' Print many lines of `bitmap_data` at once, each `line_width` bytes.
+            Sends exactly the same as doing `draw_bitmap` line by line
+        '''
+        self.send( self.make_bitmap_commands(bitmap_data, line_width) )
+
+    def make_compressed_bitmap_commands(self, bitmap_data: bytearray, line_width: int):
+        ''' Like `make_bitmap_commands`, but compress lines that are worthy so.
+            Only new kind of printers can understand
+        '''
+        view = memoryview(bitmap_data).cast('B')
+        result = bytearray()
+        # start of lines that are not worthy compressing
+        raw_start = 0
+        for start in range(0, len(view) - line_width + 1, line_width):
+            compressed = compress_bitmap_line(view[start:start + line_width], line_width)
+            if compressed is None:
+                continue
+            if raw_start != start:
+                result += self.make_bitmap_commands(view[raw_start:start], line_width)
+            result += self.make_command(0xbf, compressed)
+            raw_start = start + line_width
+        if raw_start != len(view):
+            result += self.make_bitmap_commands(view[raw_start:], line_width)
+        return result
+
     def draw_compressed_bitmap(self, bitmap_data: bytearray):
-        'TODO. Print `bitmap_data`, compress if worthy so'
-        self.draw_bitmap(bitmap_data)
+        'Print `bitmap_data`, compress if worthy so'
+        compressed = compress_bitmap_line(bitmap_data, len(bitmap_data))
+        if compressed is not None:
+            self.send( self.make_command(0xbf, compressed) )
+        else:
+            self.draw_bitmap(bitmap_data)
+
+    def draw_compressed_bitmap_lines(self, bitmap_data: bytearray, line_width: int):
+        'Print many lines of `bitmap_data` at once, compress those worthy so'
+        self.send( self.make_compressed_bitmap_commands(bitmap_data, line_width) )
 
     @abstractmethod
     def send(self, data):
@@ -58,7 +58,7 @@ class IPP():
             self.handle_postscript(data)
         else:
             identifier = server.path[1:]
-            server.printer.print(io.BytesIO(data), mode='text', identifier=identifier)
+            server.print_file(data, mode='text', identifier=identifier).wait()
     def handle_postscript(self, data):
         'Print PostScript data to printer, converting to PBM first with GhostScript `gs`'
         server = self.server
@@ -82,7 +82,7 @@ class IPP():
             if gsproc.wait() == 0:
                 identifier = server.path[1:]
                 # TODO: Make IPP can report some errors
-                server.printer.print(io.BytesIO(pbm_data), mode='pbm', identifier=identifier)
+                server.print_file(pbm_data, mode='pbm', identifier=identifier).wait()
             else:
                 raise Exception('Error on invoking Ghostscript')
             server.send_response(200)
@@ -9,8 +9,8 @@ class Model():
     ''' A printer model
         `paper_width`: pixels per line for the model/paper
         `is_new_kind`: some models have new "start print" command and can understand compressed data.
-                the algorithm isn't implemented in Cat-Printer yet, but this should be no harm.
-        `problem_feeding`: didn't yet figure out MX05/MX06 bad behavior giving feed command, use workaround for them
+        `problem_feeding`: didn't yet figure out MX05/MX06 bad behavior giving feed command, use workaround for them.
+                they are also sent blank lines as bitmap, while others get paper feed in place
     '''
     paper_width: int = 384
     is_new_kind: bool = False
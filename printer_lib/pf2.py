@@ -8,6 +8,15 @@ Don't forget to see how it's used in `text_print.py`
 '''
 
 import io
+import os
+import sys
+import mmap
+import stat
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
 from typing import Dict, Tuple
 
 def uint32be(b: bytes):
@@ -43,6 +52,10 @@ class Character():
     y_offset: int
     device_width: int
     bitmap_data: bytes
+    rows: Tuple[int, ...]
+    ''' Raster glyph unpacked to one int per row, `width` bits each,
+        the most significant bit is the leftmost pixel
+    '''
 
     def get_bit(self, x, y):
         'Get the bit at (x, y) of this character\'s raster glyph'
@@ -50,14 +63,34 @@ class Character():
         char_bit = 7 - (self.width * y + x) % 8
         return self.bitmap_data[char_byte] & (0b1 << char_bit)
 
+_uint32 = 'I' if array('I').itemsize == 4 else 'L'
+'Type code of `array` for unsigned 32-bit int'
+
+def _uint32be_array(data: bytes, start: int, step: int):
+    ''' Make an `array` of unsigned big-endian 32-bit ints in `data`,
+        beginning at `start`, one per `step` bytes
+    '''
+    count = max((len(data) - start - 4) // step + 1, 0)
+    packed = bytearray(count * 4)
+    for i in range(4):
+        packed[i::4] = data[start + i:start + count * step:step]
+    result = array(_uint32, packed)
+    if sys.byteorder == 'little':
+        result.byteswap()
+    return result
+
 class PF2():
-    'The PF2 class, for serializing a PF2 font file'
+    ''' The PF2 class, for serializing a PF2 font file.
+        Regular files are memory-mapped, others are read to memory.
+        Characters are decoded on demand
+    '''
 
     broken: bool = False
     'Sets to True if the font file is bad'
 
     missing_character_code: int
     in_memory: bool
+    'Whether the font data is read to memory, instead of memory-mapped'
 
     font_name: str
     family: str
@@ -68,98 +101,216 @@ class PF2():
     max_height: int
     ascent: int
     descent: int
-    character_index: Dict[int, Tuple[int, int]]
-    data_offset: int
-    data_io: io.BufferedIOBase = None
+    code_points: array
+    'Code points of all characters, sorted, from the CHIX section'
+    offsets: array
+    'Offset of every character in `code_points`'
+    data: memoryview = None
+    'The whole font file'
+    _map: mmap.mmap = None
+
+    cache_size: int = 4096
+    'Max amount of decoded characters to keep'
+    cache_hits: int
+    'Amount of characters got from cache'
+    cache_misses: int
+    'Amount of characters decoded, because they\'re not in cache'
+    _cache: OrderedDict
+    'Decoded characters, keyed by `(code_point, scale)`, least recently used first'
+    _cache_lock: threading.Lock
+    'Guards `_cache`, as a font can be shared by threads (printers)'
 
-    def __init__(self, file: io.BufferedIOBase, *, read_to_mem=True, missing_character: str='?'):
+    def __init__(self, file: io.BufferedIOBase, *, read_to_mem=False, missing_character: str='?'):
         self.missing_character_code = ord(missing_character)
-        self.in_memory = read_to_mem
-        if read_to_mem:
-            self.data_io = io.BytesIO(file.read())
-            file.close()
-            file = self.data_io
-        self.is_pf2 = (file.read(12) == b'FILE\x00\x00\x00\x04PFF2')
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        try:
+            mappable = stat.S_ISREG(os.fstat(file.fileno()).st_mode)
+        except (AttributeError, OSError):
+            # not a real file, like `io.BytesIO`
+            mappable = False
+        self.in_memory = read_to_mem or not mappable
+        if self.in_memory:
+            self.data = memoryview(file.read())
+        else:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = memoryview(self._map)
+        file.close()
+        self.is_pf2 = (self.data[0:12] == b'FILE\x00\x00\x00\x04PFF2')
+        try:
+            if self.is_pf2:
+                self._read_sections()
+        except (struct.error, ValueError):
+            self.is_pf2 = False
         if not self.is_pf2:
-            return
+            self.broken = True
+
+    def _read_sections(self):
+        'Read font properties and character index, until the DATA section'
+        data = self.data
+        position = 12
         while True:
-            name = file.read(4)
-            data_length = int32be(file.read(4))
-            if name == b'CHIX':
-                self.character_index = {}
-                for _ in range(data_length // (4 + 1 + 4)):
-                    code_point = int32be(file.read(4))
-                    compression = file.read(1)[0]
-                    offset = int32be(file.read(4))
-                    self.character_index[code_point] = (
-                        compression, offset
-                    )
-                continue
-            elif name == b'DATA':
-                file.seek(0)
+            name, data_length = struct.unpack_from('>4si', data, position)
+            position += 8
+            if name == b'DATA':
                 break
-            data = file.read(data_length)
-            if name == b'NAME':
-                self.font_name = data
+            section = data[position:position + data_length]
+            position += data_length
+            if name == b'CHIX':
+                # entries are: code point (4), compression (1), offset (4)
+                section = section.tobytes()
+                self.code_points = _uint32be_array(section, 0, 9)
+                self.offsets = _uint32be_array(section, 5, 9)
+                if any(a > b for a, b in zip(self.code_points, self.code_points[1:])):
+                    # should have been sorted, but just in case
+                    pairs = sorted(zip(self.code_points, self.offsets))
+                    self.code_points = array(_uint32, (pair[0] for pair in pairs))
+                    self.offsets = array(_uint32, (pair[1] for pair in pairs))
+            elif name == b'NAME':
+                self.font_name = section.tobytes()
             elif name == b'FAMI':
-                self.family = data
+                self.family = section.tobytes()
             elif name == b'WEIG':
-                self.weight = data
+                self.weight = section.tobytes()
             elif name == b'SLAN':
-                self.slant = data
+                self.slant = section.tobytes()
             elif name == b'PTSZ':
-                self.point_size = uint16be(data)
+                self.point_size = uint16be(section)
             elif name == b'MAXW':
-                self.max_width = uint16be(data)
+                self.max_width = uint16be(section)
             elif name == b'MAXH':
-                self.max_height = uint16be(data)
+                self.max_height = uint16be(section)
             elif name == b'ASCE':
-                self.ascent = uint16be(data)
+                self.ascent = uint16be(section)
             elif name == b'DESC':
-                self.descent = uint16be(data)
+                self.descent = uint16be(section)
+
+    @property
+    def character_index(self) -> Dict[int, Tuple[int, int]]:
+        ''' `dict` of code point to `(compression, offset)`, made on demand.
+            Prefer `get_offset`
+        '''
+        return {code_point: (0, offset) for code_point, offset
+                in zip(self.code_points, self.offsets)}
+
+    @property
+    def memory_size(self):
+        'Rough amount of memory taken, in bytes, not counting memory-mapped data'
+        size = len(self.data) if self.in_memory and self.data is not None else 0
+        for indexes in (getattr(self, 'code_points', None), getattr(self, 'offsets', None)):
+            if indexes is not None:
+                size += indexes.itemsize * len(indexes)
+        with self._cache_lock:
+            chars = list(self._cache.values())
+        for char in chars:
+            # the object, bitmap data, and a tuple of ints as rows
+            size += 400 + len(char.bitmap_data) + 36 * len(char.rows)
+        return size
+
+    def get_offset(self, code_point: int):
+        'Get offset of the character at `code_point` in font data, or `None` if not there'
+        code_points = self.code_points
+        i = bisect_left(code_points, code_point)
+        if i < len(code_points) and code_points[i] == code_point:
+            return self.offsets[i]
+        return None
 
     def get_char(self, char: str):
         'Get a character, returning a `Character` instance'
-        char_point = ord(char)
-        info = self.character_index.get(char_point)
-        if info is None:
-            info = self.character_index[self.missing_character_code]
-        _compression, offset = info
-        data = self.data_io
-        data.seek(offset)
+        return self._get_cached(ord(char), 1)
+
+    def _get_cached(self, code_point: int, scale: int):
+        'Get a decoded character from cache, or decode and put it in cache'
+        key = (code_point, scale)
+        cache = self._cache
+        with self._cache_lock:
+            char = cache.get(key)
+            if char is not None:
+                cache.move_to_end(key)
+                self.cache_hits += 1
+                return char
+            self.cache_misses += 1
+        # decoding doesn't touch the cache, let others go on meanwhile
+        char = self._decode_char(code_point, scale)
+        with self._cache_lock:
+            cache[key] = char
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return char
+
+    def _decode_char(self, code_point: int, _scale: int):
+        'Read and decode a character from font data'
+        offset = self.get_offset(code_point)
+        if offset is None:
+            offset = self.get_offset(self.missing_character_code)
+            if offset is None:
+                raise KeyError(code_point)
         char = Character()
-        char.width = uint16be(data.read(2))
-        char.height = uint16be(data.read(2))
-        char.x_offset = int16be(data.read(2))
-        char.y_offset = int16be(data.read(2))
-        char.device_width = int16be(data.read(2))
-        char.bitmap_data = data.read(
-            (char.width * char.height + 7) // 8
-        )
+        (char.width, char.height, char.x_offset, char.y_offset,
+            char.device_width) = struct.unpack_from('>HHhhh', self.data, offset)
+        offset += 10
+        char.bitmap_data = self.data[
+            offset:offset + (char.width * char.height + 7) // 8
+        ].tobytes()
+        # rows of the glyph are packed together, not aligned to bytes
+        width = char.width
+        mask = (1 << width) - 1
+        bits = int.from_bytes(char.bitmap_data, 'big')
+        shift = len(char.bitmap_data) * 8
+        rows = []
+        for _ in range(char.height):
+            shift -= width
+            rows.append(bits >> shift & mask)
+        char.rows = tuple(rows)
         return char
 
     __getitem__ = get_char
 
     def __del__(self):
-        if self.data_io is not None:
-            self.data_io.close()
+        if self.data is not None:
+            self.data.release()
+        if self._map is not None:
+            self._map.close()
 
 
+def _make_scale_table(scale: int):
+    'Make a table of every byte value, with every bit repeated `scale` times'
+    table = []
+    for value in range(256):
+        scaled = 0
+        for i in range(7, -1, -1):
+            bit = value >> i & 1
+            scaled = scaled << scale | (((1 << scale) - 1) if bit else 0)
+        table.append(scaled)
+    return table
+
+_scale_tables = {}
+'Tables made by `_make_scale_table`, keyed by scale'
+
+def scale_row(row: int, width: int, scale: int):
+    'Scale a glyph `row` of `width` bits horizontally, by repeating every bit `scale` times'
+    table = _scale_tables.get(scale)
+    if table is None:
+        table = _scale_tables[scale] = _make_scale_table(scale)
+    padding = -width % 8
+    shift = 8 * scale
+    scaled = 0
+    for value in (row << padding).to_bytes((width + 7) // 8, 'big'):
+        scaled = scaled << shift | table[value]
+    return scaled >> padding * scale
+
 class CharacterS(Character):
-    'A "scaled" character'
+    ''' A "scaled" character.
+        `rows` and `bitmap_data` are already scaled up
+    '''
 
     scale: int = 1
 
     def get_bit(self, x, y):
         'Get the bit at (x, y) of this character\'s raster glyph'
-        scale = self.scale
-        width = self.width // scale
-        x //= scale
-        y //= scale
-        char_byte = (width * y + x) // 8
-        char_bit = 7 - (width * y + x) % 8
-        return (self.bitmap_data[char_byte] &
-                (0b1 << char_bit)) >> char_bit
+        return self.rows[y] >> (self.width - 1 - x) & 1
 
 class PF2S(PF2):
     'PF2 class with glyph scaling support'
@@ -178,8 +329,10 @@ class PF2S(PF2):
         self.descent *= scale
 
     def get_char(self, char):
-        scale = self.scale
-        char = super().get_char(char)
+        return self._get_cached(ord(char), self.scale)
+
+    def _decode_char(self, code_point, scale):
+        char = super()._decode_char(code_point, 1)
         chars = CharacterS()
         chars.scale = scale
         chars.width = char.width * scale
@@ -187,7 +340,20 @@ class PF2S(PF2):
         chars.device_width = char.device_width * scale
         chars.x_offset = char.x_offset * scale
         chars.y_offset = char.y_offset * scale
-        chars.bitmap_data = char.bitmap_data
+        if scale == 1:
+            chars.bitmap_data = char.bitmap_data
+            chars.rows = char.rows
+            return chars
+        rows = []
+        bits = 0
+        for row in char.rows:
+            row = scale_row(row, char.width, scale)
+            for _ in range(scale):
+                rows.append(row)
+                bits = bits << chars.width | row
+        chars.rows = tuple(rows)
+        size = chars.width * chars.height
+        chars.bitmap_data = (bits << (-size % 8)).to_bytes((size + 7) // 8, 'big')
         return chars
 
     __getitem__ = get_char
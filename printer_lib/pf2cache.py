@@ -0,0 +1,301 @@
+'''
+Precompiled cache of PF2 fonts, for loading quicker.
+
+A cache file is made for a font at a scale. It has fixed-size glyph records,
+with rows already unpacked (and scaled), and a dense index of code points.
+It's memory-mapped when loaded, so nothing is decoded before being used.
+It's tied to the content of the font, check it with `is_fresh`.
+Size and modification time of the font are also kept, so that a font
+that's not touched can be checked without reading it, see `is_same_file`.
+
+Make one with:
+    python3 -m printer_lib.pf2cache [-s SCALE ...] [-o DIR] font.pf2 ...
+Then put it together with the font, as `<name>.s<scale>.pf2c`
+
+No rights reserved.
+License CC0-1.0-only: https://directory.fsf.org/wiki/License:CC0
+'''
+
+import io
+import os
+import sys
+import mmap
+import zlib
+import struct
+import argparse
+import threading
+from array import array
+from collections import OrderedDict
+
+from .pf2 import PF2S, CharacterS, _uint32
+
+MAGIC = b'PF2CACHE'
+VERSION = 2
+
+Header = struct.Struct('<8sHHIIQ8HIIII')
+''' Header of cache file:
+    magic, version, scale, source CRC32, source size, source modification time (ns, 0 if unknown),
+    point size, max width, max height, ascent, descent,
+    cell width, cell height, row bytes,
+    first code point, amount of code points, amount of glyphs, index of missing glyph
+'''
+GlyphHeader = struct.Struct('<HHhhh')
+'Header of a glyph record: width, height, x offset, y offset, device width'
+
+def cache_name(name: str, scale: int):
+    'Name of cache file for a font `name` (without `.pf2`) at `scale`'
+    return f'{name}.s{scale}.pf2c'
+
+def source_key(data):
+    'The key of a PF2 font `data` that a cache is tied to: `(crc32, size)`'
+    return zlib.crc32(data), len(data)
+
+def source_stat(file: io.BufferedIOBase):
+    'Size and modification time (ns) of font `file`, or `None` if it\'s not a real file'
+    try:
+        stat = os.fstat(file.fileno())
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+_mtime_offset = struct.calcsize('<8sHHII')
+'Where the source modification time is in the header'
+
+def _read_source(file: io.BufferedIOBase):
+    'Get data of font `file`, memory-mapped if possible'
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return file.read()
+
+def compile_pf2(file: io.BufferedIOBase, output: io.BufferedIOBase, scale: int=1):
+    'Compile PF2 font `file` at `scale` to cache, write to `output`'
+    stat = source_stat(file)
+    data = _read_source(file)
+    crc32, size = source_key(data)
+    mtime = stat[1] if stat is not None and stat[0] == size else 0
+    pf2 = PF2S(io.BytesIO(data), scale=scale)
+    if pf2.broken:
+        raise ValueError('Not a PF2 font')
+    code_points = pf2.code_points
+    # size of cells from glyph headers, no need to decode them all
+    cell_width = cell_height = 0
+    for offset in pf2.offsets:
+        width, height = struct.unpack_from('>HH', pf2.data, offset)
+        cell_width = max(cell_width, width * scale)
+        cell_height = max(cell_height, height * scale)
+    row_bytes = (cell_width + 7) // 8
+    first = code_points[0] if code_points else 0
+    count = code_points[-1] - first + 1 if code_points else 0
+    index = array(_uint32, bytes(4 * count))
+    for i, code_point in enumerate(code_points):
+        index[code_point - first] = i + 1
+    missing = pf2.get_offset(pf2.missing_character_code)
+    missing = 0 if missing is None else index[pf2.missing_character_code - first]
+    if sys.byteorder == 'big':
+        index.byteswap()
+    output.write(Header.pack(
+        MAGIC, VERSION, scale, crc32, size, mtime,
+        pf2.point_size, pf2.max_width, pf2.max_height, pf2.ascent, pf2.descent,
+        cell_width, cell_height, row_bytes,
+        first, count, len(code_points), missing
+    ))
+    output.write(index.tobytes())
+    record = bytearray(GlyphHeader.size + cell_height * row_bytes)
+    for code_point in code_points:
+        char = pf2._decode_char(code_point, scale)
+        record[:] = bytes(len(record))
+        GlyphHeader.pack_into(record, 0, char.width, char.height,
+                              char.x_offset, char.y_offset, char.device_width)
+        position = GlyphHeader.size
+        shift = row_bytes * 8 - char.width
+        for row in char.rows:
+            record[position:position + row_bytes] = (row << shift).to_bytes(row_bytes, 'big')
+            position += row_bytes
+        output.write(record)
+    if isinstance(data, mmap.mmap):
+        data.close()
+
+def _read_header(path: str):
+    'Unpacked header of cache file at `path`, `None` if it can\'t be read'
+    try:
+        with open(path, 'rb') as file:
+            header = file.read(Header.size)
+    except OSError:
+        return None
+    if len(header) != Header.size:
+        return None
+    return Header.unpack(header)
+
+def is_fresh(path: str, key, scale: int):
+    'Check if cache file at `path` is made from the font with `key` at `scale`'
+    header = _read_header(path)
+    if header is None:
+        return False
+    magic, version, cache_scale, crc32, size = header[0:5]
+    return (magic, version, cache_scale, (crc32, size)) == (MAGIC, VERSION, scale, tuple(key))
+
+def is_same_file(path: str, stat, scale: int):
+    ''' Check if cache file at `path` is made at `scale` from a font
+        of `stat` (size, modification time), as got by `source_stat`.
+        It doesn't read the font, but `False` doesn't mean it's stale, check `is_fresh` then
+    '''
+    header = _read_header(path)
+    if header is None or stat is None or stat[1] == 0:
+        return False
+    magic, version, cache_scale, _crc32, size, mtime = header[0:6]
+    return (magic, version, cache_scale, (size, mtime)) == (MAGIC, VERSION, scale, tuple(stat))
+
+def _update_mtime(path: str, mtime: int):
+    'Put new modification time of the font to cache at `path`, if it can be written'
+    try:
+        with open(path, 'r+b') as file:
+            file.seek(_mtime_offset)
+            file.write(struct.pack('<Q', mtime))
+    except OSError:
+        pass
+
+class PF2Cache(PF2S):
+    ''' A font loaded from cache file, made by `compile_pf2`.
+        Works like a `PF2S` at the scale it's made with.
+        Check `is_fresh` before, or give `key` to check here.
+        Sets `broken` if the file is bad or stale
+    '''
+
+    cell_width: int
+    cell_height: int
+    row_bytes: int
+    first_code: int
+    index: memoryview
+    'Glyph number (counting from 1) of every code point, from `first_code`. 0 if not there'
+    missing_glyph: int
+    _records_offset: int
+    _record_size: int
+
+    def __init__(self, file: io.BufferedIOBase, *, key=None, missing_character: str='?'):
+        # pylint: disable=super-init-not-called
+        self.missing_character_code = ord(missing_character)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.in_memory = False
+        self.is_pf2 = False
+        try:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            self.in_memory = True
+            self._map = None
+        self.data = memoryview(self._map if self._map is not None else file.read())
+        file.close()
+        if len(self.data) < Header.size:
+            self.broken = True
+            return
+        (magic, version, self.scale, crc32, size, _mtime,
+            self.point_size, self.max_width, self.max_height, self.ascent, self.descent,
+            self.cell_width, self.cell_height, self.row_bytes,
+            self.first_code, count, glyph_count, self.missing_glyph
+        ) = Header.unpack_from(self.data)
+        self._record_size = GlyphHeader.size + self.cell_height * self.row_bytes
+        self._records_offset = Header.size + 4 * count
+        if (magic != MAGIC or version != VERSION
+                or (key is not None and (crc32, size) != tuple(key))
+                or len(self.data) < self._records_offset + glyph_count * self._record_size):
+            self.broken = True
+            return
+        index = self.data[Header.size:self._records_offset]
+        if sys.byteorder == 'little' and array('I').itemsize == 4:
+            self.index = index.cast('I')
+        else:
+            self.index = array(_uint32, index.tobytes())
+            if sys.byteorder == 'big':
+                self.index.byteswap()
+        self.is_pf2 = True
+
+    def _glyph_number(self, code_point: int):
+        'Glyph number of `code_point`, 0 if not there'
+        i = code_point - self.first_code
+        if 0 <= i < len(self.index):
+            return self.index[i]
+        return 0
+
+    def _decode_char(self, code_point, _scale):
+        number = self._glyph_number(code_point) or self.missing_glyph
+        if number == 0:
+            raise KeyError(code_point)
+        offset = self._records_offset + (number - 1) * self._record_size
+        char = CharacterS()
+        char.scale = self.scale
+        (char.width, char.height, char.x_offset, char.y_offset,
+            char.device_width) = GlyphHeader.unpack_from(self.data, offset)
+        offset += GlyphHeader.size
+        row_bytes = self.row_bytes
+        shift = row_bytes * 8 - char.width
+        data = self.data
+        char.rows = tuple(
+            int.from_bytes(data[i:i + row_bytes], 'big') >> shift
+            for i in range(offset, offset + char.height * row_bytes, row_bytes)
+        )
+        bits = 0
+        for row in char.rows:
+            bits = bits << char.width | row
+        size = char.width * char.height
+        char.bitmap_data = (bits << (-size % 8)).to_bytes((size + 7) // 8, 'big')
+        return char
+
+    def __del__(self):
+        index = getattr(self, 'index', None)
+        if isinstance(index, memoryview):
+            index.release()
+        super().__del__()
+
+def load_font(file: io.BufferedIOBase, cache_path: str=None, scale: int=1):
+    ''' Load PF2 font `file` at `scale`. Use the cache at `cache_path`
+        if it's there and fresh, otherwise parse the font, as `PF2S`.
+        The font is only read (to check CRC) if its size or modification time changed
+    '''
+    if cache_path is not None and os.path.isfile(cache_path):
+        stat = source_stat(file)
+        key = None
+        fresh = is_same_file(cache_path, stat, scale)
+        if not fresh:
+            data = _read_source(file)
+            key = source_key(data)
+            if isinstance(data, mmap.mmap):
+                data.close()
+            else:
+                file = io.BytesIO(data)
+            fresh = is_fresh(cache_path, key, scale)
+            if fresh and stat is not None and stat[0] == key[1]:
+                # same content, just touched (or copied), don't check again next time
+                _update_mtime(cache_path, stat[1])
+        if fresh:
+            font = PF2Cache(open(cache_path, 'rb'), key=key)
+            if not font.broken:
+                file.close()
+                return font
+    return PF2S(file, scale=scale)
+
+def main():
+    'Command line tool, to compile PF2 fonts to cache'
+    parser = argparse.ArgumentParser(
+        description='Compile PF2 font to cache, for Cat-Printer text printing')
+    parser.add_argument('fonts', metavar='FONT', nargs='+', help='Path to PF2 font')
+    parser.add_argument('-s', '--scale', type=int, action='append',
+                        help='Scale of font, can be given multiple times. Default 1')
+    parser.add_argument('-o', '--output-dir', metavar='DIR',
+                        help='Where to put cache files. Default: same as font')
+    args = parser.parse_args()
+    for font in args.fonts:
+        name = os.path.basename(font)
+        if name.endswith('.pf2'):
+            name = name[:-4]
+        output_dir = args.output_dir or os.path.dirname(font)
+        for scale in args.scale or [1]:
+            path = os.path.join(output_dir, cache_name(name, scale))
+            with open(font, 'rb') as file, open(path, 'wb') as output:
+                compile_pf2(file, output, scale)
+            print(path)
+
+if __name__ == '__main__':
+    main()
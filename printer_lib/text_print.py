@@ -1,6 +1,56 @@
 'Things used by Text Printing feature. License CC0-1.0-only'
 
-from .pf2 import PF2S
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from .pf2cache import load_font
+
+class FontRegistry():
+    ''' Loaded fonts, keyed by `(family, scale)`, shared by every `TextCanvas`.
+        Least recently used fonts are dropped if all take more than `max_size`
+    '''
+    max_size: int
+    'Max (estimated) memory taken by fonts, in bytes'
+    _fonts: OrderedDict
+    _lock: threading.Lock
+
+    def __init__(self, max_size=64 * 1024 * 1024):
+        self.max_size = max_size
+        self._fonts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, family, scale, load):
+        ''' Get the font of `family` at `scale`, or `load()` it if not there.
+            Broken fonts are not kept
+        '''
+        key = (family, scale)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                return font
+            font = load()
+            if not font.broken:
+                self._fonts[key] = font
+                self._evict()
+            return font
+
+    def _evict(self):
+        'Drop least recently used fonts, until they fit in `max_size`'
+        sizes = {key: font.memory_size for key, font in self._fonts.items()}
+        total = sum(sizes.values())
+        while len(self._fonts) > 1 and total > self.max_size:
+            key, _font = self._fonts.popitem(last=False)
+            total -= sizes[key]
+
+    def clear(self):
+        'Drop all fonts'
+        with self._lock:
+            self._fonts.clear()
+
+font_registry = FontRegistry()
+'The process-wide `FontRegistry`'
 
 class TextCanvas():
     'Canvas for text printing, requires PF2 lib'
@@ -12,11 +62,18 @@ class TextCanvas():
     wrap: bool
     scale: int
     pf2 = None
-    def __init__(self, width, *, wrap=False, rtl=False,
-            font_path='font.pf2', font_data_io=None, scale=1):
-        if font_data_io is None:
-            font_data_io = open(font_path, 'rb')
-        self.pf2 = PF2S(font_data_io, scale=scale)
+    def __init__(self, width, *, wrap=False, rtl=False, font=None,
+            font_path='font.pf2', font_data_io=None, font_cache_path=None, scale=1):
+        ''' Give a loaded `font` (like from `font_registry`) to share it,
+            otherwise a font is loaded from the other arguments
+        '''
+        if font is not None:
+            self.pf2 = font
+            scale = font.scale
+        else:
+            if font_data_io is None:
+                font_data_io = open(font_path, 'rb')
+            self.pf2 = load_font(font_data_io, font_cache_path, scale)
         if self.pf2.broken:
             self.broken = True
             return
@@ -38,55 +95,92 @@ class TextCanvas():
         ''' Put the specified text to canvas.
             It's a generator, will `yield` the data produced, per line.
         '''
+        for line in self.layout(text):
+            yield self.rasterize(line)
+    def layout(self, text):
+        ''' Lay out `text` to lines, by real advances of glyphs, in one pass.
+            If `wrap`, lines break after a space or a wide (CJK) character,
+            otherwise at any character that doesn't fit.
+            It's a generator, will `yield` every line as a `list` of `(character, x)`
+        '''
         text = text.replace('\t', ' ' * 4)
-        canvas_length = len(self.canvas)
         pf2 = self.pf2
-        current_width = 0
-        last_space_at = -1
-        width_at_last_space = 0
-        break_points = set()
-        characters = {}
-        for i, s in enumerate(text):
-            if s not in characters:
-                characters[s] = pf2[s]
-            char = characters[s]
-            if s == ' ':
-                last_space_at = i
-                width_at_last_space = current_width
-            if (current_width > self.width and
-                last_space_at != -1):
-                break_points.add(last_space_at)
-                current_width -= width_at_last_space
+        width = self.width
+        line = []
+        pen = 0
+        break_at = 0    # where in `line` it's fine to break, after a space etc.
+        wrapped = False
+        for s in text:
             if s == '\n':
-                current_width = 0
+                yield line
+                line, pen, break_at, wrapped = [], 0, 0, False
                 continue
-            current_width += pf2.point_size // 2 # + char.x_offset
-        current_width = 0
-        for i, s in enumerate(text):
-            char = characters[s]
-            if ((self.wrap and i in break_points) or s == '\n' or
-                current_width + char.width > self.width):
-                # print(current_width, end=' ')
-                yield self.flush_canvas()
-                current_width = 0
-                if s in ' ':
-                    continue
-            if ord(s) in range(0x00, 0x20):   # glyphs that should not be printed out
+            if ord(s) < 0x20:   # glyphs that should not be printed out
                 continue
-            for x in range(char.width):
-                for y in range(char.height):
-                    rtl_current_width = self.width - current_width - char.width - 1
-                    target_x = x + char.x_offset
-                    target_y = pf2.ascent + (y - char.height) - char.y_offset
-                    canvas_byte = (self.width * target_y + current_width + target_x) // 8
-                    canvas_bit = 7 - (self.width * target_y + current_width + target_x) % 8
-                    if self.rtl:
-                        canvas_byte = (self.width * target_y + rtl_current_width + target_x) // 8
-                        canvas_bit = 7 - (self.width * target_y + rtl_current_width + target_x) % 8
-                    else:
-                        canvas_byte = (self.width * target_y + current_width + target_x) // 8
-                        canvas_bit = 7 - (self.width * target_y + current_width + target_x) % 8
-                    if canvas_byte < 0 or canvas_byte >= canvas_length:
-                        continue
-                    self.canvas[canvas_byte] |= char.get_bit(x, y) << canvas_bit
-            current_width += char.device_width
+            if s == ' ' and wrapped and not line:
+                continue
+            char = pf2[s]
+            if line and pen + char.x_offset + char.width > width:
+                wrapped = True
+                if s == ' ':
+                    yield line
+                    line, pen, break_at = [], 0, 0
+                    continue
+                if self.wrap and 0 < break_at < len(line):
+                    # carry the last word to next line
+                    yield line[:break_at]
+                    offset = line[break_at][1]
+                    line = [(glyph, x - offset) for glyph, x in line[break_at:]]
+                    pen -= offset
+                break_at = 0
+                if line and pen + char.x_offset + char.width > width:
+                    # (the carried word is still) too long, break right here
+                    yield line
+                    line, pen = [], 0
+            line.append((char, pen))
+            pen += char.device_width
+            if s == ' ' or unicodedata.east_asian_width(s) in 'WF':
+                break_at = len(line)
+        if line:
+            yield line
+    def rasterize(self, line, canvas=None):
+        ''' Put a line made by `layout` to canvas, returning the canvas data.
+            To reuse memory, give a blank writable buffer of `width * height // 8` bytes
+            as `canvas`, to draw there instead
+        '''
+        ascent = self.pf2.ascent
+        for char, x in line:
+            if self.rtl:
+                x = self.width - x - char.width - 1
+            self.put_char(char, x + char.x_offset, ascent - char.height - char.y_offset, canvas)
+        if canvas is not None:
+            return canvas
+        return self.flush_canvas()
+    def put_char(self, char, x, y, canvas=None):
+        ''' Put the raster glyph of `char` to canvas at (x, y), row by row.
+            Like a flat buffer, what exceeds a line goes to the next one
+        '''
+        if canvas is None:
+            canvas = self.canvas
+        canvas_length = len(canvas)
+        char_width = char.width
+        start = self.width * y + x
+        for row in char.rows:
+            if row:
+                bits = (start & 7) + char_width
+                size = (bits + 7) >> 3
+                value = row << (size * 8 - bits)
+                begin = start >> 3
+                end = begin + size
+                if begin < 0 or end > canvas_length:
+                    # clip the bytes outside of canvas
+                    data = value.to_bytes(size, 'big')
+                    data = data[max(-begin, 0):max(canvas_length - begin, 0)]
+                    begin = max(begin, 0)
+                    end = begin + len(data)
+                    value = int.from_bytes(data, 'big')
+                if begin < end:
+                    canvas[begin:end] = (
+                        int.from_bytes(canvas[begin:end], 'big') | value
+                    ).to_bytes(end - begin, 'big')
+            start += self.width
@@ -12,18 +12,26 @@ import os
 import io
 import sys
 import json
+import time
+import queue
+import itertools
 import warnings
+import threading
 import webbrowser
 
-# For now we can't use `ThreadingHTTPServer`
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from operator import methodcaller
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 # import `printer` first, to diagnostic some common errors
-from printer import PrinterDriver, PrinterError, i18n, info
+from printer import PrinterDriver, PrinterError, i18n, info, error
 
 from bleak.exc import BleakDBusError, BleakError    # pylint: disable=wrong-import-order
 
 from printer_lib.ipp import IPP
+from printer_lib.models import Model, Models, isValidModel
 
 # Supress non-sense asyncio warnings
 warnings.simplefilter('ignore', RuntimeWarning, 0, True)
@@ -65,6 +73,536 @@ def concat_files(*paths, prefix_format='', buffer=4 * 1024 * 1024) -> bytes:
             while data := file.read(buffer):
                 yield data
 
+def pbm_size(data: bytes):
+    'Get `(width, height)` of the first page of PBM image `data`, or None if it\'s not one'
+    file = io.BytesIO(data)
+    if file.readline() != b'P4\n':
+        return None
+    while (line := file.readline())[0:1] == b'#':
+        pass
+    try:
+        width, height = map(int, line.split())
+    except ValueError:
+        return None
+    return width, height
+
+def estimate_job(data: bytes, mode: str):
+    ''' Estimate `(width, rows)` of printing `data` in `mode`,
+        that is the paper width it needs (None for any) and amount of lines
+    '''
+    if mode == 'text':
+        # roughly, lines of unifont that are not wrapped
+        return None, (data.count(b'\n') + 1) * 16
+    size = pbm_size(data)
+    if size is None or size[0] < 8:
+        return None, 0
+    width = size[0]
+    return width, len(data) // (width // 8)
+
+def error_details(e: Exception):
+    'Describe error `e` for an API response'
+    if isinstance(e, BleakDBusError):
+        # TODO: better error reporting
+        return {
+            'name': e.dbus_error,
+            'details': e.dbus_error_details
+        }
+    if isinstance(e, BleakError):
+        return {
+            'name': 'BleakError',
+            'details': str(e)
+        }
+    if isinstance(e, EOFError):
+        # mostly, device disconnected but not by this program
+        return {
+            'name': 'EOFError',
+            'details': ''
+        }
+    if isinstance(e, RuntimeError):
+        return {
+            'name': 'RuntimeError',
+            'details': str(e)
+        }
+    if isinstance(e, PrinterError):
+        return {
+            'name': e.message,
+            'details': e.message_localized
+        }
+    return {
+        'name': 'Exception',
+        'details': str(e)
+    }
+
+class PrinterWorker():
+    ''' The one thread that uses the printer (`PrinterDriver`), one thing at a time.
+        Request handlers give it work, and wait for the result if they need.
+        Work runs in order it's given, those with higher `priority` first
+    '''
+
+    printer: PrinterDriver = None
+
+    _queue: queue.PriorityQueue = None
+
+    _order: itertools.count = None
+
+    _thread: threading.Thread = None
+
+    def __init__(self, printer: PrinterDriver):
+        self.printer = printer
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._thread = threading.Thread(target=self._run, name='PrinterWorker', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while (work := self._queue.get()[2]) is not None:
+            future, function, args, kwargs = work
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def submit(self, function, *args, priority=0, **kwargs) -> Future:
+        'Queue `function` to be called on the worker, return a `Future` of its result'
+        future = Future()
+        self._queue.put((-priority, next(self._order), (future, function, args, kwargs)))
+        return future
+
+    def call(self, function, *args, **kwargs):
+        'Call `function` on the worker, wait and return its result (or raise its error)'
+        return self.submit(function, *args, **kwargs).result()
+
+    def stop(self):
+        'Finish the work given before, then stop'
+        self._queue.put((float('inf'), next(self._order), None))
+        self._thread.join()
+
+class EventSubscription():
+    ''' Events for one subscriber (client) of `EventHub`, at most `size` of them.
+        If it's slow to take them, the oldest ones are dropped
+    '''
+
+    _hub: 'EventHub' = None
+
+    _events: deque = None
+
+    _condition: threading.Condition = None
+
+    def __init__(self, hub: 'EventHub', size: int):
+        self._hub = hub
+        self._events = deque(maxlen=size)
+        self._condition = threading.Condition()
+
+    def put(self, message: bytes):
+        'Put an event `message`'
+        with self._condition:
+            self._events.append(message)
+            self._condition.notify()
+
+    def get(self, timeout: float=None):
+        ''' Wait & take all events as a `list`, which is empty on timeout.
+            Returns None if the hub is closed
+        '''
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._events or self._hub.closed, timeout)
+            if self._hub.closed:
+                return None
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+    def wake(self):
+        'Wake up the waiting `get`'
+        with self._condition:
+            self._condition.notify()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self._hub.unsubscribe(self)
+
+class EventHub():
+    ''' Passes events to every subscriber, as Server-Sent Events messages.
+        Each subscriber keeps at most `buffer_size` events not taken yet
+    '''
+
+    buffer_size: int
+
+    closed: bool = False
+
+    _subscriptions: set = None
+
+    _ids: itertools.count = None
+
+    _lock: threading.Lock = None
+
+    def __init__(self, buffer_size=256):
+        self.buffer_size = buffer_size
+        self._subscriptions = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publish(self, event: str, data):
+        'Publish `event` with JSON `data` to all subscribers'
+        data = json.dumps(data)
+        with self._lock:
+            message = f'id: {next(self._ids)}\nevent: {event}\ndata: {data}\n\n'.encode('utf-8')
+            for subscription in self._subscriptions:
+                subscription.put(message)
+
+    def subscribe(self):
+        'Subscribe to events from now on. Use the result in a `with` statement'
+        subscription = EventSubscription(self, self.buffer_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: EventSubscription):
+        'Stop passing events to `subscription`'
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def close(self):
+        'Let all subscribers stop'
+        with self._lock:
+            self.closed = True
+            for subscription in self._subscriptions:
+                subscription.wake()
+
+class PrintJob():
+    ''' A printing job, run by the printer worker.
+        Progress is counted from the printer while it's running
+    '''
+
+    id: int
+    mode: str
+    priority: int
+    size: int
+    'Size of data to print, in bytes'
+    width: int = None
+    'Paper width the job needs, None for any'
+    estimated_rows: int = 0
+    pinned: int = None
+    'ID of the printer the job must run on, None for any'
+    printer: int = None
+    'ID of the printer running the job'
+
+    status: str = 'queued'
+    'One of `queued`, `running`, `done`, `failed` and `cancelled`'
+    error: dict = None
+    'Details of the error, if failed'
+
+    created: float
+    started: float = None
+    ended: float = None
+
+    rows: int = 0
+    'Amount of bitmap lines sent to printer'
+    bytes_sent: int = 0
+    paused_time: float = 0.0
+    'Time spent waiting for printer to resume, in seconds'
+
+    future: Future = None
+    'Result of the job'
+
+    events: EventHub = None
+    'Where to publish events of the job'
+
+    _printer: PrinterDriver = None
+
+    _start_counters: tuple = None
+
+    _cancel: threading.Event = None
+
+    def __init__(self, job_id: int, mode: str, priority: int, size: int, *,
+                 width: int=None, estimated_rows: int=0, pinned: int=None):
+        self.id = job_id
+        self.mode = mode
+        self.priority = priority
+        self.size = size
+        self.width = width
+        self.estimated_rows = estimated_rows
+        self.pinned = pinned
+        self.created = time.time()
+        self.future = Future()
+        self._cancel = threading.Event()
+
+    @property
+    def cancel_event(self):
+        'Event to be set to cancel the job, to give to `PrinterDriver.print`'
+        return self._cancel
+
+    @property
+    def ended_already(self):
+        'Whether the job is done, failed or cancelled'
+        return self.status not in ('queued', 'running')
+
+    def _counters(self):
+        printer = self._printer
+        return printer.rows_sent, printer.flow.bytes_sent, printer.flow.paused_time
+
+    def progress(self):
+        'Get `(rows, bytes_sent, paused_time)` so far'
+        if self.status == 'running':
+            return tuple(now - start for now, start in
+                         zip(self._counters(), self._start_counters))
+        return self.rows, self.bytes_sent, self.paused_time
+
+    def publish(self, event: str):
+        'Publish `event` about the job, with its status'
+        if self.events is not None:
+            self.events.publish(event, self.to_json())
+
+    def start(self, printer: PrinterDriver, event: str='started'):
+        ''' To be called on the worker when it starts printing with `printer`.
+            Publishes `event`, which is `connecting` if the printer connects first
+        '''
+        self._printer = printer
+        self._start_counters = self._counters()
+        self.started = time.time()
+        self.status = 'running'
+        self.publish(event)
+
+    def end(self, status: str, details: dict=None):
+        'To be called when the job ends, with `status`, and `details` of the error if failed'
+        if self._printer is not None:
+            self.rows, self.bytes_sent, self.paused_time = self.progress()
+        self.error = details
+        self.ended = time.time()
+        self.status = status
+        self.publish('finished' if status == 'done' else status)
+
+    def cancel(self):
+        ''' Cancel the job. A queued one is dropped, a running one stops
+            sending data, then the printer feeds paper.
+            Returns False if it already ended
+        '''
+        if self.ended_already:
+            return False
+        if self.future.cancel():
+            self.end('cancelled')
+            return True
+        self._cancel.set()
+        return True
+
+    def wait(self):
+        'Wait until the job ends, raise the error if it failed'
+        self.future.result()
+
+    def to_json(self):
+        'Status of the job, for an API response'
+        rows, bytes_sent, paused_time = self.progress()
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'priority': self.priority,
+            'size': self.size,
+            'pinned': self.pinned,
+            'printer': self.printer,
+            'status': self.status,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'ended': self.ended,
+            'rows': rows,
+            'bytes_sent': bytes_sent,
+            'paused_time': paused_time
+        }
+
+class PrintJobs():
+    ''' All printing jobs, by ID.
+        Only the latest `keep` ones are kept, after they end
+    '''
+
+    keep: int
+
+    events: EventHub = None
+    'Where jobs publish their events'
+
+    _jobs: OrderedDict = None
+
+    _ids: itertools.count = None
+
+    _lock: threading.Lock = None
+
+    def __init__(self, events: EventHub=None, keep=64):
+        self.events = events
+        self.keep = keep
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def new(self, mode: str, priority: int, size: int, **details):
+        'Make a new job. See `PrintJob` for `details`'
+        with self._lock:
+            job = PrintJob(next(self._ids), mode, priority, size, **details)
+            job.events = self.events
+            self._jobs[job.id] = job
+            ended = [key for key, other in self._jobs.items() if other.ended_already]
+            for key in ended[:max(len(ended) - self.keep, 0)]:
+                del self._jobs[key]
+        job.publish('queued')
+        return job
+
+    def get(self, job_id: int):
+        'Get job of `job_id`, or None if not there'
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def all(self):
+        'Get all jobs, older first'
+        with self._lock:
+            return list(self._jobs.values())
+
+class PooledPrinter():
+    'A printer in `PrinterPool`, with its own worker'
+
+    id: int
+
+    identifier: str = None
+    'Model name & address of the printer, like `GB03,AA:BB:CC:DD:EE:FF`. None to use any found'
+
+    worker: PrinterWorker = None
+
+    busy: bool = False
+    'Whether it\'s running a job'
+
+    throughput: float = None
+    'Measured speed of printing, in lines per second'
+
+    def __init__(self, printer_id: int, printer: PrinterDriver, identifier: str=None):
+        self.id = printer_id
+        self.identifier = identifier
+        self.worker = PrinterWorker(printer)
+
+    @property
+    def printer(self) -> PrinterDriver:
+        'The printer'
+        return self.worker.printer
+
+    @property
+    def model(self) -> Model:
+        'Model of the printer, known by connected device or `identifier`'
+        if self.printer.model is not None:
+            return self.printer.model
+        return Models.get((self.identifier or '').split(',')[0], Models['_ZZ00'])
+
+    def fits(self, job: PrintJob):
+        'Whether `job` can run on this printer'
+        return (job.pinned in (None, self.id) and
+                job.width in (None, self.model.paper_width))
+
+    def _throughput(self):
+        return self.throughput or (
+            self.printer.flow.rate / (self.model.paper_width // 8))
+
+    def expected_time(self, rows: int):
+        ''' Expected time to print `rows` lines, in seconds.
+            Before measured, guess by paper width & sending rate
+        '''
+        return rows / self._throughput()
+
+    def measure(self, job: PrintJob):
+        ''' Take the measurement of throughput from a `job` just ended.
+            A failed job halves it, so other printers are preferred for a while
+        '''
+        if job.status == 'failed':
+            self.throughput = self._throughput() / 2
+            return
+        if job.status != 'done' or job.rows == 0 or job.ended <= job.started:
+            return
+        throughput = job.rows / (job.ended - job.started)
+        self.throughput = (throughput if self.throughput is None
+                           else (self.throughput + throughput) / 2)
+
+    def to_json(self):
+        'Status of the printer, for an API response'
+        return {
+            'id': self.id,
+            'identifier': self.identifier,
+            'paper_width': self.model.paper_width,
+            'connected': self.printer.device is not None,
+            'busy': self.busy,
+            'throughput': self.throughput
+        }
+
+class PrinterPool():
+    ''' Printers, each with its own worker, to run printing jobs on.
+        Jobs wait here until there's an idle printer for them, higher `priority` first.
+        A job goes to the idle printer expected to finish it first, unless pinned to one
+    '''
+
+    printers: list = None
+
+    _pending: list = None
+
+    _lock: threading.Lock = None
+
+    def __init__(self):
+        self.printers = []
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add(self, printer: PrinterDriver, identifier: str=None):
+        'Add `printer` of `identifier` to pool, return the `PooledPrinter`'
+        with self._lock:
+            pooled = PooledPrinter(len(self.printers), printer, identifier)
+            self.printers.append(pooled)
+            self._dispatch()
+            return pooled
+
+    def get(self, printer_id: int):
+        'Get printer of `printer_id`, or None if not there'
+        if isinstance(printer_id, int) and 0 <= printer_id < len(self.printers):
+            return self.printers[printer_id]
+        return None
+
+    def submit(self, job: PrintJob, run, *args):
+        ''' Queue `job`, to run as `run(job, pooled_printer, *args)`
+            on the worker of the chosen printer
+        '''
+        with self._lock:
+            self._pending.append((job, run, args))
+            self._dispatch()
+
+    def _dispatch(self):
+        'Send pending jobs to idle printers. Call with lock held'
+        self._pending = [item for item in self._pending if not item[0].future.done()]
+        self._pending.sort(key=lambda item: (-item[0].priority, item[0].id))
+        for item in tuple(self._pending):
+            job = item[0]
+            idle = [pooled for pooled in self.printers
+                    if not pooled.busy and pooled.fits(job)]
+            if not idle:
+                continue
+            pooled = min(idle, key=methodcaller('expected_time', job.estimated_rows))
+            pooled.busy = True
+            job.printer = pooled.id
+            self._pending.remove(item)
+            pooled.worker.submit(self._run, pooled, *item)
+
+    def _run(self, pooled: PooledPrinter, job: PrintJob, run, args):
+        future = job.future
+        # it may be cancelled before running
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(run(job, pooled, *args))
+            except Exception as e:
+                future.set_exception(e)
+        with self._lock:
+            pooled.busy = False
+            pooled.measure(job)
+            self._dispatch()
+
+    def stop(self):
+        'Stop workers of printers, after they finish their work'
+        for pooled in self.printers:
+            pooled.worker.stop()
+
 class PrinterServerHandler(BaseHTTPRequestHandler):
     '(Local) server handler for Cat Printer Web interface'
 
@@ -85,11 +623,18 @@ class PrinterServerHandler(BaseHTTPRequestHandler):
     _settings_blacklist = (
         'printer', 'is_android'
     )
-    all_script: list = []
+    _settings_lock = threading.RLock()
 
     printer: PrinterDriver = PrinterDriver()
+    'The main printer, that is first in `server.pool`. Use it only on `server.worker`'
+
+    progress_interval: float = 0.5
+    'Least interval between `progress` events of a job, in seconds'
+
+    keep_alive_interval: float = 15.0
+    'Interval of keep-alive messages in event stream, when there are no events'
 
-    ipp: IPP = None
+    server: 'PrinterServer'
 
     def log_request(self, _code=200, _size=0):
         pass
@@ -99,10 +644,9 @@ class PrinterServerHandler(BaseHTTPRequestHandler):
 
     def handle_one_request(self):
         try:
-            # this handler would have only one instance
-            # broken pipe could make it die. ignore
+            # client may go away before we respond. ignore
             super().handle_one_request()
-        except BrokenPipeError:
+        except (BrokenPipeError, ConnectionResetError):
             pass
 
     def do_GET(self):
@@ -113,6 +657,9 @@ class PrinterServerHandler(BaseHTTPRequestHandler):
             return
         if path == '/':
             path += 'index.html'
+        if path == '/events':
+            self.stream_events()
+            return
         # special
         if path.startswith('/~'):
             action = path[2:]
@@ -120,7 +667,7 @@ class PrinterServerHandler(BaseHTTPRequestHandler):
                 self.send_response(200)
                 self.send_header('Content-Type', mime(path))
                 self.end_headers()
-                for data in concat_files(*(self.all_script), prefix_format='\n// {0}\n'):
+                for data in concat_files(*(self.server.all_script), prefix_format='\n// {0}\n'):
                     self.wfile.write(data)
                 return
         path = 'www' + path
@@ -142,9 +689,25 @@ class PrinterServerHandler(BaseHTTPRequestHandler):
                     break
         return
 
-    def api_success(self, body_json=None):
+    def stream_events(self):
+        ''' Stream events of printing jobs as Server-Sent Events, until client leaves.
+            Events are `queued`, `connecting` (then `started` once connected) or `started`,
+            `progress`, `paused`, `resumed`,
+            and at last `finished`, `failed` or `cancelled`, with status of the job as data
+        '''
+        # subscribe first, so nothing is missed once the client gets the response
+        with self.server.events.subscribe() as subscription:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            while (events := subscription.get(self.keep_alive_interval)) is not None:
+                # a comment, to keep connection & find out if client has left
+                self.wfile.write(b''.join(events) or b': keep-alive\n\n')
+
+    def api_success(self, body_json=None, code=200):
         'Called when an API call is being considered successful'
-        self.send_response(200)
+        self.send_response(code)
         self.send_header('Content-Type', mime('json'))
         self.end_headers()
         if body_json is None:
@@ -152,108 +715,228 @@ class PrinterServerHandler(BaseHTTPRequestHandler):
         else:
             self.wfile.write(json.dumps(body_json).encode('utf-8'))
 
-    def api_fail(self, error_json):
+    def api_fail(self, error_json, code=500):
         'Called when an API call is failed'
-        self.send_response(500)
+        self.send_response(code)
         self.send_header('Content-Type', mime('json'))
         self.end_headers()
         self.wfile.write(json.dumps(error_json).encode('utf-8'))
         self.wfile.flush()
 
-    def load_config(self):
+    @classmethod
+    def load_config(cls):
         'Load config file, or if not exist, create one with default'
-        if IsAndroid:
-            self.settings['is_android'] = True
-            from android.storage import app_storage_path    # pylint: disable=import-error
-            settings_path = app_storage_path()
-            os.makedirs(settings_path, exist_ok=True)
-            self.settings['config_path'] = os.path.join(
-                settings_path, 'config.json'
-            )
-        if os.path.exists(self.settings.config_path):
-            with open(self.settings.config_path, 'r', encoding='utf-8') as file:
-                settings = DictAsObject(json.load(file))
-                if (settings.version is None or
-                    settings.version < self.settings.version):
-                    # Version too old, start over
-                    # TODO: selective?
-                    self.save_config()
-                    return
-                for key in settings:
-                    self.settings[key] = settings[key]
-        else:
-            if os.name in ('posix',) or IsAndroid:
-                self.settings['scan_time'] = 2.0
-            self.save_config()
+        with cls._settings_lock:
+            if IsAndroid:
+                cls.settings['is_android'] = True
+                from android.storage import app_storage_path    # pylint: disable=import-error
+                settings_path = app_storage_path()
+                os.makedirs(settings_path, exist_ok=True)
+                cls.settings['config_path'] = os.path.join(
+                    settings_path, 'config.json'
+                )
+            if os.path.exists(cls.settings.config_path):
+                with open(cls.settings.config_path, 'r', encoding='utf-8') as file:
+                    settings = DictAsObject(json.load(file))
+                    if (settings.version is None or
+                        settings.version < cls.settings.version):
+                        # Version too old, start over
+                        # TODO: selective?
+                        cls.save_config()
+                        return
+                    for key in settings:
+                        cls.settings[key] = settings[key]
+            else:
+                if os.name in ('posix',) or IsAndroid:
+                    cls.settings['scan_time'] = 2.0
+                cls.save_config()
 
-    def save_config(self):
+    @classmethod
+    def save_config(cls):
         'Save config file'
-        with open(self.settings.config_path, 'w', encoding='utf-8') as file:
-            settings = {}
-            for i in self.settings:
-                if i not in self._settings_blacklist:
-                    settings[i] = self.settings[i]
-            json.dump(settings, file, indent=4)
-
-    def update_printer(self):
-        'Update `PrinterDriver` state/config'
-        self.printer.dry_run = self.settings.dry_run
-        self.printer.scan_time = self.settings.scan_time
-        self.printer.fake = self.settings.fake
-        self.printer.dump = self.settings.dump
-        if self.settings.energy is not None:
-            self.printer.energy = int(self.settings.energy) * 0x100
-        if self.settings.quality is not None:
-            self.printer.speed = int(self.settings.quality)
-        self.printer.flip_h = self.settings.flip_h or self.settings.flip
-        self.printer.flip_v = self.settings.flip_v or self.settings.flip
-        self.printer.rtl = self.settings.force_rtl
+        with cls._settings_lock:
+            with open(cls.settings.config_path, 'w', encoding='utf-8') as file:
+                settings = {}
+                for i in cls.settings:
+                    if i not in cls._settings_blacklist:
+                        settings[i] = cls.settings[i]
+                json.dump(settings, file, indent=4)
+
+    def update_printer(self, printer: PrinterDriver=None):
+        'Update `PrinterDriver` (default the main one) state/config. Call it on its worker'
+        printer = printer or self.printer
+        with self._settings_lock:
+            printer.dry_run = self.settings.dry_run
+            printer.scan_time = self.settings.scan_time
+            printer.fake = self.settings.fake
+            printer.dump = self.settings.dump
+            if self.settings.energy is not None:
+                printer.energy = int(self.settings.energy) * 0x100
+            if self.settings.quality is not None:
+                printer.speed = int(self.settings.quality)
+            printer.flip_h = self.settings.flip_h or self.settings.flip
+            printer.flip_v = self.settings.flip_v or self.settings.flip
+            printer.rtl = self.settings.force_rtl
+
+    def _run_job(self, job: PrintJob, pooled: PooledPrinter, file: io.BufferedIOBase,
+                 kwargs: dict):
+        printer = pooled.printer
+        if pooled.identifier is not None:
+            kwargs = dict(kwargs, identifier=pooled.identifier)
+        last_progress = 0.0
+        connecting = False
+        def listener(what):
+            nonlocal last_progress, connecting
+            if connecting:
+                # it's connected, as data is being sent
+                connecting = False
+                job.publish('started')
+            if what == 'sent':
+                now = time.perf_counter()
+                if now - last_progress < self.progress_interval:
+                    return
+                last_progress = now
+            job.publish({'sent': 'progress', 'pause': 'paused', 'resume': 'resumed'}[what])
+        try:
+            self.update_printer(printer)
+            connecting = printer.device is None and not printer.fake
+            job.start(printer, 'connecting' if connecting else 'started')
+            printer.flow.listener = listener
+            done = printer.print(file, mode=job.mode, cancel=job.cancel_event, **kwargs)
+        except Exception as e:
+            job.end('failed', error_details(e))
+            raise
+        finally:
+            printer.flow.listener = None
+        job.end('done' if done else 'cancelled')
+
+    def print_file(self, data: bytes, *, mode='default', priority=0, printer: int=None,
+                   **kwargs):
+        ''' Queue printing of `data` with current settings, in the printer pool.
+            Give `printer` ID to pin the job to it. Returns the `PrintJob`
+        '''
+        pool = self.server.pool
+        width, rows = estimate_job(data, mode)
+        candidates = pool.printers
+        if printer is not None:
+            if pool.get(printer) is None:
+                error('printer-not-found', exception=PrinterServerError)
+            candidates = [pool.get(printer)]
+        # a job no printer fits would wait forever
+        if width is not None and not any(pooled.model.paper_width == width
+                                         for pooled in candidates):
+            error('unsuitable-image-width-expected-0-got-1',
+                  candidates[0].model.paper_width, width, exception=PrinterError)
+        job = self.server.jobs.new(mode, priority, len(data), width=width,
+                                   estimated_rows=rows, pinned=printer)
+        pool.submit(job, self._run_job, io.BytesIO(data), kwargs)
+        return job
+
+    def _get_job(self, data: DictAsObject):
+        'Get job of ID in `data`, or fail the request with 404'
+        job = self.server.jobs.get(data.id)
+        if job is None:
+            self.api_fail({
+                'name': 'job-not-found',
+                'details': str(data.id)
+            }, 404)
+        return job
+
+    def _scan(self, everything):
+        self.printer.connect(None)
+        return self.printer.scan(everything=everything)
 
     def handle_api(self):
         'Handle API request from POST'
         content_length = int(self.headers.get('Content-Length'))
         body = self.rfile.read(content_length)
-        api = self.path[1:]
+        path, _, query = self.path.partition('?')
+        api = path[1:]
+        worker = self.server.worker
         if api == 'print':
-            self.update_printer()
-            self.printer.print(io.BytesIO(body))
-            self.api_success()
+            options = parse_qs(query)
+            printer = options.get('printer', [None])[0]
+            job = self.print_file(body, mode=options.get('mode', ['default'])[0],
+                                  priority=int(options.get('priority', [0])[0]),
+                                  printer=None if printer is None else int(printer))
+            self.api_success(job.to_json(), 202)
             return
         data = DictAsObject(json.loads(body))
+        if api == 'printers':
+            self.api_success({
+                'printers': [pooled.to_json() for pooled in self.server.pool.printers]
+            })
+            return
+        if api == 'add-printer':
+            identifier = data.device
+            name, _, address = (identifier if isinstance(identifier, str) else '').partition(',')
+            if not address or ',' in address:
+                self.api_fail({
+                    'name': 'invalid-device',
+                    'details': str(identifier)
+                }, 400)
+                return
+            if not isValidModel(name):
+                self.api_fail({
+                    'name': 'model-0-is-not-supported-yet',
+                    'details': name
+                }, 400)
+                return
+            with self._settings_lock:
+                self.settings['printers'] = (self.settings.printers or []) + [identifier]
+                self.save_config()
+            pooled = self.server.add_printer(identifier)
+            self.api_success(pooled.to_json())
+            return
+        if api == 'jobs':
+            self.api_success({
+                'jobs': [job.to_json() for job in self.server.jobs.all()]
+            })
+            return
+        if api == 'job':
+            if (job := self._get_job(data)) is not None:
+                self.api_success(job.to_json())
+            return
+        if api == 'cancel':
+            if (job := self._get_job(data)) is not None:
+                job.cancel()
+                self.api_success(job.to_json())
+            return
         if api == 'devices':
-            self.printer.connect(None)
             devices_list = [{
                 'name': device.name,
                 'address': device.address
-            } for device in self.printer.scan(everything=data.get('everything'))]
+            } for device in worker.call(self._scan, data.get('everything'))]
             self.api_success({
                 'devices': devices_list
             })
             return
         if api == 'query':
             self.load_config()
-            self.api_success(self.settings)
+            with self._settings_lock:
+                self.api_success(self.settings)
             return
         if api == 'set':
-            for key in data:
-                self.settings[key] = data[key]
-            self.save_config()
-            self.update_printer()
+            with self._settings_lock:
+                for key in data:
+                    self.settings[key] = data[key]
+                self.save_config()
+            # applies after the printing (if any), no need to wait
+            for pooled in self.server.pool.printers:
+                pooled.worker.submit(self.update_printer, pooled.printer)
             self.api_success()
             return
         if api == 'connect':
             name, address = data['device'].split(',')
-            self.printer.connect(name, address)
+            worker.call(self.printer.connect, name, address)
             self.api_success()
         if api == 'exit':
             self.api_success()
             self.exit()
 
     def exit(self):
-        'Stop correctly & cleanly'
-        self.save_config()
-        self.printer.unload()
-        sys.exit(0)
+        'Stop the server correctly & cleanly. The printer finishes its work first'
+        self.server.shutdown()
 
     def do_POST(self):
         'Called when server got a POST http request'
@@ -263,75 +946,67 @@ class PrinterServerHandler(BaseHTTPRequestHandler):
         ):
             return
         if self.headers.get('Content-Type') == 'application/ipp':
-            if self.ipp is None:
-                self.ipp = IPP(self)
-            self.ipp.handle_ipp()
+            IPP(self).handle_ipp()
             return
         try:
             self.handle_api()
-            return
-        except BleakDBusError as e:
-            # TODO: better error reporting
-            self.api_fail({
-                'name': e.dbus_error,
-                'details': e.dbus_error_details
-            })
-        except BleakError as e:
-            self.api_fail({
-                'name': 'BleakError',
-                'details': str(e)
-            })
-        except EOFError as e:
-            # mostly, device disconnected but not by this program
-            self.api_fail({
-                'name': 'EOFError',
-                'details': ''
-            })
-        except RuntimeError as e:
-            self.api_fail({
-                'name': 'RuntimeError',
-                'details': str(e)
-            })
-        except PrinterError as e:
-            self.api_fail({
-                'name': e.message,
-                'details': e.message_localized
-            })
+        except (BleakError, EOFError, RuntimeError, PrinterError) as e:
+            self.api_fail(error_details(e))
         except Exception as e:
-            self.api_fail({
-                'name': 'Exception',
-                'details': str(e)
-            })
+            self.api_fail(error_details(e))
             raise
 
-class PrinterServer(HTTPServer):
+class PrinterServer(ThreadingHTTPServer):
     ''' (local) server for Cat Printer Web Interface
-        The reason to override is to only init the handler once,
-        avoiding confliction, and stop cleanly
+        Every request is handled in its own thread, so the interface
+        stays responsive while printing. Every printer in `pool` is only used by its worker
     '''
 
-    handler_class = None
-    handler: PrinterServerHandler = None
+    daemon_threads = True
+
+    pool: PrinterPool = None
+    'Printers to print with. The first is the main one, used by Web interface'
+
+    worker: PrinterWorker = None
+    'Worker of the main printer'
+
+    jobs: PrintJobs = None
+
+    events: EventHub = None
+
+    all_script: list = None
+    'Paths of scripts that are put together as `/~every.js`'
 
     def __init__(self, server_address, RequestHandlerClass):
-        self.handler_class = RequestHandlerClass
         super().__init__(server_address, RequestHandlerClass)
+        RequestHandlerClass.load_config()
+        with open(os.path.join('www', 'all-scripts.txt'), 'r', encoding='utf-8') as file:
+            self.all_script = [os.path.join('www', path)
+                               for path in file.read().split('\n') if path != '']
+        self.pool = PrinterPool()
+        self.worker = self.pool.add(RequestHandlerClass.printer).worker
+        for identifier in RequestHandlerClass.settings.printers or []:
+            self.add_printer(identifier)
+        self.events = EventHub()
+        self.jobs = PrintJobs(self.events)
 
-    def finish_request(self, request, client_address):
-        if self.handler is None:
-            self.handler = self.handler_class(request, client_address, self)
-            self.handler.load_config()
-            with open(os.path.join('www', 'all-scripts.txt'), 'r', encoding='utf-8') as file:
-                for path in file.read().split('\n'):
-                    if path != '':
-                        self.handler.all_script.append(os.path.join('www', path))
-            return
-        self.handler.__init__(request, client_address, self)
+    def add_printer(self, identifier: str):
+        'Add a printer of `identifier` (`name,address`) to pool'
+        return self.pool.add(PrinterDriver(), identifier)
 
     def server_close(self):
-        if self.handler is not None:
-            self.handler.exit()
         super().server_close()
+        self.events.close()
+        if self.worker is not None:
+            # running jobs are finished, but not those in queue
+            for job in self.jobs.all():
+                if job.status == 'queued':
+                    job.cancel()
+            self.pool.stop()
+            self.worker = None
+            self.RequestHandlerClass.save_config()
+            for pooled in self.pool.printers:
+                pooled.printer.unload()
 
 
 def serve():
@@ -363,6 +1038,8 @@ def serve():
     try:
         server.serve_forever()
     except KeyboardInterrupt:
+        pass
+    finally:
         server.server_close()
 
 if __name__ == '__main__':
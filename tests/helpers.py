@@ -0,0 +1,132 @@
+'Things shared by tests'
+
+import struct
+import random
+import asyncio
+import threading
+
+from bleak.exc import BleakError
+
+from printer_lib.commander import reverse_bits_table
+
+def _section(name: bytes, data: bytes):
+    return name + struct.pack('>I', len(data)) + data
+
+def make_pf2(seed: int=1):
+    ''' Make a small PF2 font in memory, with ASCII and some CJK characters.
+        Glyphs are random, but the same for a same `seed`
+    '''
+    rng = random.Random(seed)
+    code_points = list(range(0x20, 0x7f)) + list(range(0x4e00, 0x4e40))
+    header = b''.join((
+        _section(b'FILE', b'PFF2'),
+        _section(b'NAME', b'Test Regular 16'),
+        _section(b'FAMI', b'Test'),
+        _section(b'WEIG', b'normal'),
+        _section(b'SLAN', b'normal'),
+        _section(b'PTSZ', struct.pack('>H', 16)),
+        _section(b'MAXW', struct.pack('>H', 16)),
+        _section(b'MAXH', struct.pack('>H', 16)),
+        _section(b'ASCE', struct.pack('>H', 14)),
+        _section(b'DESC', struct.pack('>H', 2)),
+    ))
+    data_start = len(header) + 8 + 9 * len(code_points) + 8
+    index = bytearray()
+    glyphs = bytearray()
+    for code_point in code_points:
+        if code_point >= 0x4e00:
+            width, height, x_offset, y_offset = 16, 16, 0, -2
+        elif code_point == 0x20:
+            width, height, x_offset, y_offset = 0, 0, 0, 0
+        else:
+            width, height = rng.randint(3, 9), rng.randint(6, 14)
+            x_offset, y_offset = rng.randint(0, 1), rng.randint(-2, 1)
+        device_width = width + x_offset + 1 if code_point != 0x20 else 5
+        bitmap = bytes(rng.getrandbits(8) for _ in range((width * height + 7) // 8))
+        index += struct.pack('>IBI', code_point, 0, data_start + len(glyphs))
+        glyphs += struct.pack('>HHhhh', width, height, x_offset, y_offset, device_width) + bitmap
+    return header + _section(b'CHIX', bytes(index)) + b'DATA\xff\xff\xff\xff' + glyphs
+
+class _Characteristic():
+    properties = ['write-without-response', 'write']
+    max_write_without_response_size = 244
+
+class _Services():
+    def get_characteristic(self, _uuid):
+        return _Characteristic()
+
+class SimulatedClient():
+    ''' Stands for `BleakClient`, as a printer that takes whatever is written.
+        Data written is kept in `sessions`, one `bytearray` per connection.
+        Writes wait while `gate` is cleared, and the connection is lost
+        before a write if `drop_when` returns true (once).
+        Connecting fails while `refuse` is set
+    '''
+
+    instances = []
+    services = _Services()
+    _backend = None
+    mtu_size = 247
+
+    def __init__(self, address, *, disconnected_callback=None, **_kwargs):
+        self.address = address
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.sessions = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.drop_when = None
+        self.refuse = False
+        SimulatedClient.instances.append(self)
+
+    async def connect(self, timeout=None, **_kwargs):
+        if self.refuse:
+            raise BleakError('Device not found')
+        self.is_connected = True
+        self.sessions.append(bytearray())
+        return True
+
+    async def disconnect(self):
+        self.is_connected = False
+
+    async def start_notify(self, _char, _callback):
+        pass
+
+    async def stop_notify(self, _char):
+        pass
+
+    def drop(self, loop: asyncio.AbstractEventLoop):
+        'Lose the connection, Bleak tells it in `loop`'
+        self.is_connected = False
+        loop.call_soon_threadsafe(self.disconnected_callback, self)
+
+    async def write_gatt_char(self, _char, data, response=None):
+        while not self.gate.is_set():
+            await asyncio.sleep(0.01)
+        if self.drop_when is not None and self.drop_when():
+            self.drop_when = None
+            self.drop(asyncio.get_running_loop())
+        if not self.is_connected:
+            raise BleakError('Not connected')
+        self.sessions[-1] += data
+
+def commands(data: bytes):
+    'Commands in `data` sent to the printer, as `(command, payload)`'
+    result = []
+    i = 0
+    while i + 8 <= len(data):
+        command, length = data[i + 2], data[i + 4] | data[i + 5] << 8
+        result.append((command, bytes(data[i + 6:i + 6 + length])))
+        i += 8 + length
+    return result
+
+def bitmap_rows(data: bytes):
+    'Lines of bitmap in `draw_bitmap` commands of `data`, as sent to the printer'
+    rows = []
+    i = 0
+    while i + 8 <= len(data):
+        command, length = data[i + 2], data[i + 4] | data[i + 5] << 8
+        if command == 0xa2:
+            rows.append(bytes(data[i + 6:i + 6 + length]).translate(reverse_bits_table))
+        i += 8 + length
+    return rows
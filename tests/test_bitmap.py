@@ -0,0 +1,76 @@
+import os
+import unittest
+from unittest import mock
+
+from printer_lib import bitmap
+
+def to_pixels(data: bytes, width: int, height: int):
+    'Rows of pixels, as lists of 0 or 1'
+    line = width // 8
+    return [[data[y * line + x // 8] >> (7 - x % 8) & 1 for x in range(width)]
+            for y in range(height)]
+
+def from_pixels(pixels: list):
+    return b''.join(
+        bytes(int(''.join(map(str, row[x:x + 8])), 2) for x in range(0, len(row), 8))
+        for row in pixels)
+
+def naive_flip(pixels: list, horizontally: bool, vertically: bool):
+    if horizontally:
+        pixels = [row[::-1] for row in pixels]
+    if vertically:
+        pixels = pixels[::-1]
+    return pixels
+
+def naive_rotate(pixels: list, clockwise: bool):
+    if clockwise:
+        return [list(column) for column in zip(*pixels[::-1])]
+    return [list(column) for column in zip(*pixels)][::-1]
+
+class TestBitmap(unittest.TestCase):
+    'With NumPy, if available'
+
+    def test_flip(self):
+        # not square, odd height, a line isn't a multiple of 8 bytes
+        width, height = 40, 7
+        data = os.urandom(width // 8 * height)
+        for horizontally in (False, True):
+            for vertically in (False, True):
+                with self.subTest(horizontally=horizontally, vertically=vertically):
+                    flipped = bytearray(data)
+                    bitmap.flip(flipped, width, height, horizontally, vertically)
+                    self.assertEqual(flipped, from_pixels(naive_flip(
+                        to_pixels(data, width, height), horizontally, vertically)))
+
+    def test_flip_part(self):
+        'Only `height` lines are flipped, the rest is left as is'
+        data = os.urandom(3 * 5)
+        flipped = bytearray(data)
+        bitmap.flip(memoryview(flipped), 24, 3)
+        self.assertEqual(flipped, data[6:9] + data[3:6] + data[0:3] + data[9:])
+
+    def test_rotate(self):
+        width, height = 40, 16
+        data = os.urandom(width // 8 * height)
+        for clockwise in (False, True):
+            with self.subTest(clockwise=clockwise):
+                rotated = bytearray(data)
+                self.assertEqual(bitmap.rotate(rotated, width, height, clockwise),
+                                 (height, width))
+                self.assertEqual(rotated, from_pixels(naive_rotate(
+                    to_pixels(data, width, height), clockwise)))
+
+    def test_rotate_odd_height(self):
+        with self.assertRaises(ValueError):
+            bitmap.rotate(bytearray(5 * 7), 40, 7)
+
+class TestBitmapPurePython(TestBitmap):
+    'The same, in pure Python'
+
+    def setUp(self):
+        patcher = mock.patch.object(bitmap, 'numpy', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import unittest
+
+from printer_lib.commander import Commander, compress_bitmap_line, reverse_bits_table
+
+class Recorder(Commander):
+    'Keeps what is sent'
+
+    def __init__(self):
+        self.sent = bytearray()
+
+    def send(self, data):
+        self.sent += data
+
+class TestDrawBitmapLines(unittest.TestCase):
+
+    def assertSameAsPerLine(self, bitmap: bytes, line_width: int):
+        batched = Recorder()
+        batched.draw_bitmap_lines(bitmap, line_width)
+        per_line = Recorder()
+        for start in range(0, len(bitmap), line_width):
+            per_line.draw_bitmap(bitmap[start:start + line_width])
+        self.assertEqual(batched.sent, per_line.sent)
+
+    def test_random_lines(self):
+        for line_width in (48, 57, 72):
+            with self.subTest(line_width=line_width):
+                self.assertSameAsPerLine(os.urandom(line_width * 100), line_width)
+
+    def test_blank_lines(self):
+        bitmap = os.urandom(48 * 3) + bytes(48 * 5) + os.urandom(48 * 2)
+        self.assertSameAsPerLine(bitmap, 48)
+        self.assertSameAsPerLine(bytes(48 * 4), 48)
+
+    def test_partial_final_block(self):
+        ''' Lines come in blocks, the last one being shorter.
+            Each block is sent as its own commands
+        '''
+        bitmap = os.urandom(48 * 37)
+        block = 48 * 16
+        batched = Recorder()
+        for start in range(0, len(bitmap), block):
+            batched.draw_bitmap_lines(memoryview(bitmap)[start:start + block], 48)
+        per_line = Recorder()
+        for start in range(0, len(bitmap), 48):
+            per_line.draw_bitmap(bitmap[start:start + 48])
+        self.assertEqual(batched.sent, per_line.sent)
+
+    def test_not_whole_lines(self):
+        with self.assertRaises(ValueError):
+            Recorder().draw_bitmap_lines(bytes(100), 48)
+
+def decode_runs(runs: bytes, width: int):
+    'Bitmap line of `width` pixels from `compress_bitmap_line` result'
+    bits = ''.join(('1' if run & 0x80 else '0') * (run & 0x7f) for run in runs)
+    assert len(bits) == width, f'{len(bits)} pixels, expected {width}'
+    return int(bits, 2).to_bytes(width // 8, 'big')
+
+def decode_commands(data: bytes, line_width: int):
+    'Bitmap lines of `draw_bitmap` & compressed commands, as `(lines, compressed count)`'
+    lines = []
+    compressed = 0
+    i = 0
+    while i < len(data):
+        command, length = data[i + 2], data[i + 4]
+        payload = data[i + 6:i + 6 + length]
+        if command == 0xbf:
+            lines.append(decode_runs(payload, line_width * 8))
+            compressed += 1
+        else:
+            lines.append(payload.translate(reverse_bits_table))
+        i += 8 + length
+    return lines, compressed
+
+class TestCompress(unittest.TestCase):
+
+    def test_runs(self):
+        line = bytes.fromhex('ff00f0') + bytes(3)
+        # 8 black, 8 white, 4 black, 28 white
+        self.assertEqual(compress_bitmap_line(line), bytes([0x88, 0x08, 0x84, 0x1c]))
+        self.assertEqual(decode_runs(compress_bitmap_line(line), 48), line)
+
+    def test_long_runs(self):
+        line = b'\xff' * 32 + bytes(16) + b'\x01'
+        # runs up to 127 pixels, the rest goes on in a new one
+        self.assertEqual(compress_bitmap_line(line),
+                         bytes([0xff, 0xff, 0x82, 0x7f, 0x08, 0x81]))
+        self.assertEqual(compress_bitmap_line(bytes(48)), bytes([0x7f, 0x7f, 0x7f, 0x03]))
+
+    def test_round_trip(self):
+        for line_width in (1, 17, 48, 72):
+            for line in (bytes(line_width), b'\xff' * line_width, b'\x80' * line_width,
+                         os.urandom(line_width),
+                         bytes(b if b < 0x30 else 0 for b in os.urandom(line_width))):
+                with self.subTest(line=line.hex()):
+                    self.assertEqual(decode_runs(compress_bitmap_line(line), line_width * 8),
+                                     line)
+
+    def test_gives_up(self):
+        line = b'\x55' * 6
+        self.assertIsNone(compress_bitmap_line(line, 6))
+        self.assertEqual(len(compress_bitmap_line(line)), 48)
+        # 4 runs, not shorter than 4 bytes
+        self.assertIsNone(compress_bitmap_line(bytes.fromhex('f00f0000'), 4))
+        self.assertEqual(len(compress_bitmap_line(bytes.fromhex('f00f0000'), 5)), 4)
+
+    def test_commands(self):
+        line_width = 48
+        noise = [os.urandom(line_width) for _ in range(5)]
+        sparse = [bytes(b if b < 0x10 else 0 for b in os.urandom(line_width)) for _ in range(5)]
+        lines = noise[:2] + sparse[:3] + noise[2:] + sparse[3:] + [bytes(line_width)]
+        data = Recorder().make_compressed_bitmap_commands(b''.join(lines), line_width)
+        decoded, compressed = decode_commands(data, line_width)
+        self.assertEqual(decoded, lines)
+        # noise isn't worth compressing, is sent as is
+        self.assertEqual(compressed, 6)
+
+if __name__ == '__main__':
+    unittest.main()
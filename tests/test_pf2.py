@@ -0,0 +1,46 @@
+import io
+import time
+import threading
+import unittest
+from collections import OrderedDict
+
+from printer_lib.pf2 import PF2S
+
+from .helpers import make_pf2
+
+class SlowCache(OrderedDict):
+    'Lets other threads run right after a look up, as if it\'s unlucky'
+
+    def get(self, *args):
+        value = super().get(*args)
+        time.sleep(0)
+        return value
+
+class TestCache(unittest.TestCase):
+
+    def test_threads(self):
+        font = PF2S(io.BytesIO(make_pf2()), scale=2)
+        expected = {char: font.get_char(char).rows for char in map(chr, range(0x21, 0x7f))}
+        font = PF2S(io.BytesIO(make_pf2()), scale=2)
+        # a bit less than characters used, to evict all the time
+        font.cache_size = 8
+        font._cache = SlowCache()   # pylint: disable=protected-access
+        errors = []
+        def get_chars(offset):
+            try:
+                for i in range(2000):
+                    char = chr(0x41 + (i + offset) % 10)
+                    self.assertEqual(font.get_char(char).rows, expected[char])
+            except Exception as e:  # pylint: disable=broad-except
+                errors.append(e)
+        threads = [threading.Thread(target=get_chars, args=(i, )) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(font._cache), font.cache_size)  # pylint: disable=protected-access
+        self.assertEqual(font.cache_hits + font.cache_misses, 8 * 2000)
+
+if __name__ == '__main__':
+    unittest.main()
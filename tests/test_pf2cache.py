@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from printer_lib import pf2cache
+from printer_lib.pf2 import PF2S
+from printer_lib.pf2cache import PF2Cache, compile_pf2, is_same_file, load_font, source_stat
+
+from .helpers import make_pf2
+
+class TestLoadFont(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.font_path = os.path.join(directory.name, 'test.pf2')
+        self.cache_path = os.path.join(directory.name, 'test.s1.pf2c')
+        with open(self.font_path, 'wb') as file:
+            file.write(make_pf2())
+        with open(self.font_path, 'rb') as file, open(self.cache_path, 'wb') as output:
+            compile_pf2(file, output, 1)
+
+    def load(self):
+        return load_font(open(self.font_path, 'rb'), self.cache_path, 1)
+
+    def stat(self):
+        with open(self.font_path, 'rb') as file:
+            return source_stat(file)
+
+    def test_untouched_font_is_not_read(self):
+        self.assertTrue(is_same_file(self.cache_path, self.stat(), 1))
+        with mock.patch.object(pf2cache, 'source_key', side_effect=AssertionError):
+            font = self.load()
+        self.assertIsInstance(font, PF2Cache)
+        self.assertEqual(font.get_char('A').rows, PF2S(open(self.font_path, 'rb')).get_char('A').rows)
+
+    def test_touched_font_is_checked_once(self):
+        stat = os.stat(self.font_path)
+        os.utime(self.font_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertFalse(is_same_file(self.cache_path, self.stat(), 1))
+        self.assertIsInstance(self.load(), PF2Cache)
+        # the new time is remembered
+        self.assertTrue(is_same_file(self.cache_path, self.stat(), 1))
+
+    def test_changed_font_is_not_cached(self):
+        with open(self.font_path, 'wb') as file:
+            file.write(make_pf2(seed=2))
+        font = self.load()
+        self.assertNotIsInstance(font, PF2Cache)
+        self.assertFalse(font.broken)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,303 @@
+import io
+import os
+import time
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from bleak.exc import BleakError
+
+import printer
+from printer import PrinterData, PrinterDriver, reopenable
+from printer_lib.commander import reverse_bits_table
+from printer_lib.models import Models
+
+from .helpers import SimulatedClient, bitmap_rows, commands, make_pf2
+
+def pbm(height: int, width: int=384):
+    'A random PBM image, without blank lines'
+    lines = [os.urandom(width // 8 - 1) + b'\xff' for _ in range(height)]
+    return b'P4\n%d %d\n' % (width, height) + b''.join(lines), lines
+
+class DriverTestCase(unittest.TestCase):
+    'Tests a `PrinterDriver` connected to a `SimulatedClient`'
+
+    def setUp(self):
+        patcher = mock.patch.object(printer, 'BleakClient', SimulatedClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.driver = PrinterDriver()
+        self.driver.connect('GB01', 'AA:BB:CC:DD:EE:FF')
+        self.client = self.driver.device
+        self.addCleanup(self.driver.unload)
+        # never leave the driver blocked
+        self.addCleanup(self.client.gate.set)
+
+class TestCancel(DriverTestCase):
+
+    def setUp(self):
+        # fill up quicker
+        patcher = mock.patch.object(PrinterDriver, 'transmit_queue_size', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def test_flush_waiting_for_room_is_cancelled(self):
+        self.client.gate.clear()
+        cancel = threading.Event()
+        # one is being written, the rest fill the queue
+        for _ in range(self.driver.transmit_queue_size + 1):
+            self.driver.send(b'\x00' * 16)
+            self.assertTrue(self.driver.flush(cancel))
+        self.driver.send(b'\x00' * 16)
+        threading.Timer(0.2, cancel.set).start()
+        start = time.perf_counter()
+        self.assertFalse(self.driver.flush(cancel))
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+    def test_cancel_while_queue_is_full(self):
+        self.client.gate.clear()
+        data, _lines = pbm(2000)
+        cancel = threading.Event()
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(self.driver.print(io.BytesIO(data), mode='pbm', cancel=cancel)))
+        thread.start()
+        time.sleep(0.3)
+        cancel.set()
+        time.sleep(0.3)
+        self.client.gate.set()
+        thread.join(5)
+        self.assertEqual(result, [False])
+        # only the start of printing was being written, bitmap in queue is dropped
+        self.assertEqual(bitmap_rows(self.client.sessions[-1]), [])
+
+class TestReopenable(unittest.TestCase):
+
+    def test_bytes(self):
+        original = io.BytesIO(b'0123456789')
+        original.seek(2)
+        file, reopen = reopenable(original)
+        self.assertEqual(file.read(4), b'2345')
+        file.close()
+        self.assertFalse(original.closed)
+        self.assertEqual(reopen().read(), b'23456789')
+
+    def test_file(self):
+        with tempfile.NamedTemporaryFile() as named:
+            named.write(b'0123456789')
+            named.flush()
+            with open(named.name, 'rb') as original:
+                original.seek(2)
+                file, reopen = reopenable(original)
+                self.assertIs(file, original)
+                file.close()
+                with reopen() as again:
+                    self.assertEqual(again.read(), b'23456789')
+
+    def test_not_possible(self):
+        class Stream(io.RawIOBase):
+            'Something that can be read only once'
+            def readable(self):
+                return True
+        stream = Stream()
+        self.assertEqual(reopenable(stream), (stream, None))
+
+class TestBlankLines(unittest.TestCase):
+
+    def setUp(self):
+        self.driver = PrinterDriver()
+        self.driver.model = Models['GB01']
+
+    def draw(self, data: bytes):
+        self.driver._draw_bitmap_lines(data)    # pylint: disable=protected-access
+
+    def sent(self):
+        'Commands sent, bitmap lines as `draw`, with bits as in the image'
+        result = []
+        data = self.driver._take_pending_data()     # pylint: disable=protected-access
+        for command, payload in commands(data):
+            if command == 0xa2:
+                result.append(('draw', payload.translate(reverse_bits_table)))
+            elif command == 0xa1:
+                result.append(('feed', int.from_bytes(payload, 'little')))
+        return result
+
+    def test_feed(self):
+        first, last = os.urandom(48), os.urandom(48)
+        self.draw(first + bytes(48 * 600) + last)
+        self.assertEqual(self.sent(), [
+            ('draw', first), ('feed', 255), ('feed', 255), ('feed', 90), ('draw', last)
+        ])
+        self.assertEqual(self.driver.rows_drawn, 602)
+
+    def test_across_blocks(self):
+        'Blank lines are pended until a line is drawn, even in the next block'
+        lines = [os.urandom(48) for _ in range(3)]
+        self.draw(lines[0] + bytes(48 * 200))
+        self.assertEqual(self.sent(), [('draw', lines[0])])
+        self.draw(bytes(48 * 100) + lines[1] + lines[2])
+        self.assertEqual(self.sent(), [
+            ('feed', 255), ('feed', 45), ('draw', lines[1]), ('draw', lines[2])
+        ])
+
+class TestPrinterData(unittest.TestCase):
+    'Ring buffer of 10 lines, 2 bytes each'
+
+    def setUp(self):
+        self.data = PrinterData(16, max_size=20)
+        self.lines = []
+
+    def add_page(self, height):
+        lines = [os.urandom(2) for _ in range(height)]
+        self.data.from_pbm(io.BytesIO(b'P4\n16 %d\n' % height + b''.join(lines)))
+        self.lines += lines
+
+    def kept(self, chunks):
+        return b''.join(chunks)
+
+    def test_empty(self):
+        self.assertIsNone(self.data.data)
+        self.assertEqual((self.data.height, self.data.pages), (0, []))
+        self.assertEqual(list(self.data.read()), [])
+        self.assertEqual(list(self.data.page(0)), [])
+        self.assertEqual(list(self.data.page(-1)), [])
+
+    def test_wraparound(self):
+        self.add_page(6)
+        self.add_page(6)
+        self.assertTrue(self.data.full)
+        # the oldest 2 lines are dropped, data crosses the end of buffer
+        self.assertEqual((self.data.height, self.data.pages), (10, [4, 6]))
+        self.assertEqual(len(list(self.data.read())), 2)
+        self.assertEqual(self.kept(self.data.read()), b''.join(self.lines[2:]))
+        self.assertEqual(self.kept(self.data.tail(3)), b''.join(self.lines[-3:]))
+        self.assertEqual(self.kept(self.data.tail(20)), b''.join(self.lines[2:]))
+        self.assertEqual(self.kept(self.data.page(0)), b''.join(self.lines[2:6]))
+        self.assertEqual(self.kept(self.data.page(-1)), b''.join(self.lines[6:]))
+        self.assertEqual(list(self.data.page(2)), [])
+        # a page dropped entirely is forgotten
+        self.add_page(6)
+        self.assertEqual(self.data.pages, [4, 6])
+        self.assertEqual(self.kept(self.data.page(0)), b''.join(self.lines[8:12]))
+        self.assertEqual(self.kept(self.data.read(3)),
+                         b''.join(self.lines[8:]))
+        self.assertTrue(all(len(chunk) <= 3 for chunk in self.data.read(3)))
+
+    def test_flip_across_wrap(self):
+        self.add_page(3)
+        self.add_page(9)
+        self.assertEqual(self.data.pages, [1, 9])
+        self.data.flip(horizontally=True, vertically=True)
+        mirrored = [line[::-1].translate(reverse_bits_table) for line in self.lines[2:]]
+        self.assertEqual(self.kept(self.data.read()), b''.join(reversed(mirrored)))
+        self.assertEqual(self.data.pages, [9, 1])
+        self.assertEqual(self.kept(self.data.page(-1)), mirrored[0])
+
+    def test_mapped(self):
+        with tempfile.NamedTemporaryFile() as named:
+            named.write(b'P4\n16 2\n' + bytes(4) + b'P4\n16 1\n\xff\xff')
+            named.flush()
+            data = PrinterData(16, open(named.name, 'rb'))
+            self.assertTrue(data.mapped)
+            # no ring buffer is made
+            self.assertIsNone(data.data)
+            self.assertEqual(data.pages, [2, 1])
+            self.assertEqual(self.kept(data.page(1)), b'\xff\xff')
+            del data
+
+class TestParallelText(DriverTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # workers look for the font on their own, by the path
+        self.driver.font_family = os.path.join(directory.name, 'test')
+        with open(self.driver.font_family + '.pf2', 'wb') as file:
+            file.write(make_pf2())
+        self.driver.text_chunk_lines = 4
+        self.driver.flow.rate = self.driver.flow.max_rate
+
+    def print_text(self, text: str, workers: int):
+        'Print `text` with `workers`, return what the printer got'
+        session = self.client.sessions[-1]
+        start = len(session)
+        self.driver.text_workers = workers
+        self.driver.print(io.BytesIO(text.encode('utf-8')), mode='text')
+        return bytes(session[start:])
+
+    def test_same_as_serial(self):
+        text = ''.join(f'{i}: Hello, world!\n\n{"一丁七" * 10}\n{"word " * 40}\n'
+                       for i in range(4))
+        for wrap, flip in ((True, False), (False, True)):
+            with self.subTest(wrap=wrap, flip=flip):
+                self.driver.wrap = wrap
+                self.driver.flip_h = self.driver.flip_v = flip
+                serial = self.print_text(text, 0)
+                self.assertGreater(len(bitmap_rows(serial)), 200)
+                self.assertEqual(self.print_text(text, 2), serial)
+
+class TestReconnect(DriverTestCase):
+
+    def drop_after(self, rows: int):
+        ''' Lose the connection once `rows` lines are sent.
+            Returns a list, that gets the amount of lines sent then
+        '''
+        lost_at = []
+        def drop_when():
+            if self.driver.rows_sent >= rows:
+                lost_at.append(self.driver.rows_sent)
+                return True
+            return False
+        self.client.drop_when = drop_when
+        return lost_at
+
+    def assertPrintedOnce(self, lines, lost_at):
+        ''' Check that the job is resumed from the last line sent before connection is lost,
+            so that all `lines` are printed just once, with one reconnection
+        '''
+        self.assertEqual(len(lost_at), 1)
+        first, second = (bitmap_rows(session) for session in self.client.sessions)
+        self.assertEqual(len(first), lost_at[0])
+        self.assertEqual(first + second, lines)
+
+    def test_retry(self):
+        data, lines = pbm(1000)
+        lost_at = self.drop_after(300)
+        file = io.BytesIO(data)
+        self.assertTrue(self.driver.print(file, mode='pbm'))
+        self.assertPrintedOnce(lines, lost_at)
+        self.assertTrue(file.closed)
+
+    def test_retry_file(self):
+        data, lines = pbm(1000)
+        lost_at = self.drop_after(300)
+        with tempfile.NamedTemporaryFile() as named:
+            named.write(data)
+            named.flush()
+            self.assertTrue(self.driver.print(open(named.name, 'rb'), mode='pbm'))
+        self.assertPrintedOnce(lines, lost_at)
+
+    def test_retries_run_out(self):
+        self.driver.retries = 0
+        self.drop_after(300)
+        data, _lines = pbm(1000)
+        with self.assertRaises(BleakError):
+            self.driver.print(io.BytesIO(data), mode='pbm')
+
+    def test_not_reconnected(self):
+        self.driver.reconnect_timeout = 0.3
+        self.client.refuse = True
+        self.client.drop(self.driver._loop)   # pylint: disable=protected-access
+        # the driver knows it, before printing
+        while self.driver._link_up.is_set():    # pylint: disable=protected-access
+            time.sleep(0.01)
+        data, _lines = pbm(10)
+        with self.assertRaises(BleakError):
+            self.driver.print(io.BytesIO(data), mode='pbm')
+        self.assertEqual(len(self.client.sessions), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,337 @@
+import io
+import os
+import json
+import time
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import printer
+from printer import PrinterDriver
+from printer_lib.models import Model, Models
+from server import DictAsObject, EventHub, PrinterServer, PrinterServerHandler, PrintJobs
+
+from .helpers import SimulatedClient, bitmap_rows
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def pbm(height: int, width: int=384):
+    return b'P4\n%d %d\n' % (width, height) + b'\xff' * (width // 8 * height)
+
+class ServerTestCase(unittest.TestCase):
+    'Runs a `PrinterServer` on a free port, with a fake printer and config in a temporary directory'
+
+    def start_server(self, fake=True):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        class Handler(PrinterServerHandler):
+            settings = DictAsObject({**PrinterServerHandler.settings,
+                                     'config_path': os.path.join(directory.name, 'config.json'),
+                                     'fake': fake})
+            printer = PrinterDriver()
+            keep_alive_interval = 0.1
+        Handler.printer.model = Models['GB01']
+        server = PrinterServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.addCleanup(stop)
+        return server
+
+    def setUp(self):
+        # paths of Web interface are relative
+        cwd = os.getcwd()
+        os.chdir(root)
+        self.addCleanup(os.chdir, cwd)
+
+    def url(self, server, path):
+        return f'http://127.0.0.1:{server.server_address[1]}{path}'
+
+    def get(self, server, path):
+        with urllib.request.urlopen(self.url(server, path)) as response:
+            return response.read()
+
+    def post(self, server, path, body=None):
+        'POST `body` (JSON if not bytes) to API, returns `(status, result)`'
+        if not isinstance(body, bytes):
+            body = json.dumps(body or {}).encode('utf-8')
+        try:
+            with urllib.request.urlopen(self.url(server, path), body) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def events(self, server):
+        'Open event stream, returns a generator of every event as `(name, data)`'
+        response = urllib.request.urlopen(self.url(server, '/events'))
+        def read():
+            with response:
+                name = None
+                for line in response:
+                    if line.startswith(b'event: '):
+                        name = line[7:].strip().decode('utf-8')
+                    elif line.startswith(b'data: '):
+                        yield name, json.loads(line[6:])
+        return read()
+
+    def block_printer(self, server):
+        ''' Make jobs on the main printer keep running until the returned event is set.
+            Returns `(started, release)` events
+        '''
+        started = threading.Event()
+        release = threading.Event()
+        def make_job(_file, _mode):
+            started.set()
+            while not release.is_set():
+                time.sleep(0.01)
+                yield False
+        printer = server.RequestHandlerClass.printer
+        patcher = mock.patch.object(printer, '_make_job', make_job)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(release.set)
+        return started, release
+
+    def wait_ended(self, server, job_id):
+        job = server.jobs.get(job_id)
+        try:
+            job.future.result(5)
+        except Exception:   # pylint: disable=broad-except
+            pass
+        return job
+
+class TestServer(ServerTestCase):
+
+    def test_scripts_are_not_repeated(self):
+        first = self.get(self.start_server(), '/~every.js')
+        second = self.get(self.start_server(), '/~every.js')
+        self.assertEqual(first, second)
+        self.assertGreater(len(first), 0)
+
+    def test_add_printer(self):
+        server = self.start_server()
+        status, pooled = self.post(server, '/add-printer', {'device': 'GB01,AA:BB:CC:DD:EE:FF'})
+        self.assertEqual((status, pooled['id']), (200, 1))
+        for device, name in ((None, 'invalid-device'),
+                             ('GB01', 'invalid-device'),
+                             ('XX99,AA:BB:CC:DD:EE:FF', 'model-0-is-not-supported-yet')):
+            status, result = self.post(server, '/add-printer', {'device': device})
+            self.assertEqual((status, result['name']), (400, name))
+        self.assertEqual(len(server.pool.printers), 2)
+
+class TestPrintJobs(unittest.TestCase):
+
+    def test_status(self):
+        jobs = PrintJobs()
+        job = jobs.new('pbm', 0, 100)
+        self.assertEqual(job.status, 'queued')
+        self.assertIs(jobs.get(job.id), job)
+        printer = PrinterDriver()
+        job.start(printer)
+        self.assertEqual(job.status, 'running')
+        printer.rows_drawn += 20
+        printer.rows_sent += 10
+        self.assertEqual(job.to_json()['rows'], 10)
+        job.end('done')
+        self.assertEqual(job.status, 'done')
+        self.assertTrue(job.ended_already)
+        self.assertEqual(job.rows, 10)
+        self.assertFalse(job.cancel())
+
+    def test_ended_are_dropped(self):
+        jobs = PrintJobs(keep=2)
+        ended = [jobs.new('pbm', 0, 100) for _ in range(4)]
+        for job in ended:
+            job.end('done')
+        queued = jobs.new('pbm', 0, 100)
+        self.assertEqual(jobs.all(), ended[2:] + [queued])
+
+class TestEventHub(unittest.TestCase):
+
+    def test_publish(self):
+        hub = EventHub()
+        with hub.subscribe() as subscription:
+            hub.publish('queued', {'id': 1})
+            hub.publish('started', {'id': 1})
+            self.assertEqual(subscription.get(1), [
+                b'id: 1\nevent: queued\ndata: {"id": 1}\n\n',
+                b'id: 2\nevent: started\ndata: {"id": 1}\n\n',
+            ])
+            self.assertEqual(subscription.get(0.01), [])
+        hub.publish('finished', {'id': 1})
+        self.assertEqual(subscription.get(0.01), [])
+
+    def test_oldest_are_dropped(self):
+        hub = EventHub(buffer_size=2)
+        with hub.subscribe() as subscription:
+            for i in range(3):
+                hub.publish('progress', i)
+            self.assertEqual([event.split(b'\n')[2] for event in subscription.get(1)],
+                             [b'data: 1', b'data: 2'])
+
+    def test_close(self):
+        hub = EventHub()
+        results = []
+        with hub.subscribe() as subscription:
+            thread = threading.Thread(target=lambda: results.append(subscription.get()))
+            thread.start()
+            hub.close()
+            thread.join(5)
+        self.assertEqual(results, [None])
+
+class TestEvents(ServerTestCase):
+
+    def test_job_events(self):
+        server = self.start_server()
+        events = self.events(server)
+        job = self.post(server, '/print', pbm(10))[1]
+        names = []
+        for name, data in events:
+            self.assertEqual(data['id'], job['id'])
+            names.append(name)
+            if name == 'finished':
+                break
+        events.close()
+        self.assertEqual(names, ['queued', 'started', 'finished'])
+        # the stream is left, found out by keep-alive
+        for _ in range(50):
+            if not server.events._subscriptions:    # pylint: disable=protected-access
+                break
+            time.sleep(0.1)
+        self.assertFalse(server.events._subscriptions)  # pylint: disable=protected-access
+
+    def test_connecting(self):
+        patcher = mock.patch.object(printer, 'BleakClient', SimulatedClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        server = self.start_server(fake=False)
+        pooled = server.add_printer('GB01,AA:BB:CC:DD:EE:FF')
+        events = self.events(server)
+        job = self.post(server, f'/print?printer={pooled.id}', pbm(10))[1]
+        names = []
+        for name, data in events:
+            names.append(name)
+            if name == 'connecting':
+                self.assertEqual((data['status'], data['printer']), ('running', pooled.id))
+            if name == 'finished':
+                break
+        events.close()
+        self.assertEqual(names[:3], ['queued', 'connecting', 'started'])
+        self.assertEqual(server.jobs.get(job['id']).status, 'done')
+
+    def test_progress_is_what_is_sent(self):
+        patcher = mock.patch.object(printer, 'BleakClient', SimulatedClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        server = self.start_server(fake=False)
+        pooled = server.add_printer('GB01,AA:BB:CC:DD:EE:FF')
+        first = self.post(server, f'/print?printer={pooled.id}', pbm(10))[1]
+        self.wait_ended(server, first['id'])
+        client = pooled.printer.device
+        self.addCleanup(client.gate.set)
+        def received():
+            return len(bitmap_rows(client.sessions[-1])) - 10
+        client.gate.clear()
+        events = self.events(server)
+        job = self.post(server, f'/print?printer={pooled.id}', pbm(2000))[1]
+        # let the driver draw ahead, while nothing reaches the printer
+        for _ in range(50):
+            if pooled.printer.rows_drawn > pooled.printer.rows_sent:
+                break
+            time.sleep(0.1)
+        self.assertGreater(pooled.printer.rows_drawn, pooled.printer.rows_sent)
+        self.assertEqual(self.post(server, '/job', {'id': job['id']})[1]['rows'], 0)
+        client.gate.set()
+        progress = []
+        for name, data in events:
+            if name == 'progress':
+                progress.append(data['rows'])
+                self.assertLessEqual(data['rows'], received())
+            if name == 'finished':
+                self.assertEqual(data['rows'], 2000)
+                break
+        events.close()
+        self.assertTrue(progress)
+
+class TestJobs(ServerTestCase):
+
+    def test_print(self):
+        server = self.start_server()
+        status, job = self.post(server, '/print', pbm(100))
+        self.assertEqual(status, 202)
+        self.assertEqual(job['status'], 'queued')
+        self.wait_ended(server, job['id'])
+        status, job = self.post(server, '/job', {'id': job['id']})
+        self.assertEqual((status, job['status'], job['rows']), (200, 'done', 100))
+
+    def test_priority(self):
+        server = self.start_server()
+        started, release = self.block_printer(server)
+        self.post(server, '/print', pbm(1))
+        started.wait(5)
+        low = self.post(server, '/print', pbm(1))[1]
+        high = self.post(server, '/print?priority=5', pbm(1))[1]
+        release.set()
+        low, high = self.wait_ended(server, low['id']), self.wait_ended(server, high['id'])
+        self.assertLess(high.started, low.started)
+
+    def test_cancel_queued(self):
+        server = self.start_server()
+        started, release = self.block_printer(server)
+        running = self.post(server, '/print', pbm(1))[1]
+        started.wait(5)
+        queued = self.post(server, '/print', pbm(1))[1]
+        status, job = self.post(server, '/cancel', {'id': queued['id']})
+        self.assertEqual((status, job['status']), (200, 'cancelled'))
+        release.set()
+        self.assertEqual(self.wait_ended(server, running['id']).status, 'done')
+        job = server.jobs.get(queued['id'])
+        self.assertEqual(job.status, 'cancelled')
+        self.assertIsNone(job.started)
+
+    def test_cancel_running(self):
+        server = self.start_server()
+        started, _release = self.block_printer(server)
+        running = self.post(server, '/print', pbm(1))[1]
+        started.wait(5)
+        self.assertEqual(self.post(server, '/job', {'id': running['id']})[1]['status'], 'running')
+        self.post(server, '/cancel', {'id': running['id']})
+        self.assertEqual(self.wait_ended(server, running['id']).status, 'cancelled')
+
+    def test_failed_printer_is_avoided(self):
+        server = self.start_server()
+        server.add_printer('GB01,AA:BB:CC:DD:EE:FF').printer.model = Models['GB01']
+        def make_job(_file, _mode):
+            raise RuntimeError('Broken printer')
+        patcher = mock.patch.object(server.RequestHandlerClass.printer, '_make_job', make_job)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        failed = self.wait_ended(server, self.post(server, '/print', pbm(10))[1]['id'])
+        self.assertEqual((failed.status, failed.printer), ('failed', 0))
+        job = self.wait_ended(server, self.post(server, '/print', pbm(10))[1]['id'])
+        self.assertEqual((job.status, job.printer), ('done', 1))
+
+    def test_pinned_to_unsuitable_printer(self):
+        server = self.start_server()
+        wide = Model()
+        wide.paper_width = 576
+        server.add_printer('GB01,AA:BB:CC:DD:EE:FF').printer.model = wide
+        status, result = self.post(server, '/print?printer=0', pbm(10, 576))
+        self.assertEqual((status, result['name']), (500, 'unsuitable-image-width-expected-0-got-1'))
+        status, job = self.post(server, '/print?printer=1', pbm(10, 576))
+        self.assertEqual(status, 202)
+        self.assertEqual(self.wait_ended(server, job['id']).status, 'done')
+
+    def test_unknown_job(self):
+        server = self.start_server()
+        status, result = self.post(server, '/cancel', {'id': 99})
+        self.assertEqual((status, result['name']), (404, 'job-not-found'))
+
+if __name__ == '__main__':
+    unittest.main()
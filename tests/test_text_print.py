@@ -0,0 +1,44 @@
+import io
+import unittest
+
+from printer_lib.pf2 import PF2S
+from printer_lib.text_print import TextCanvas
+
+from .helpers import make_pf2
+
+class TestLayout(unittest.TestCase):
+
+    width = 96
+
+    def setUp(self):
+        self.font = PF2S(io.BytesIO(make_pf2()))
+
+    def layout(self, text, wrap):
+        canvas = TextCanvas(self.width, wrap=wrap, font=self.font)
+        return list(canvas.layout(text))
+
+    def assertFits(self, lines):
+        for line in lines:
+            for char, x in line:
+                self.assertLessEqual(x + char.x_offset + char.width, self.width)
+
+    def test_lines_fit(self):
+        text = 'a ' + 'b' * 40 + ' cc ' + 'd' * 7 + ' 一丁七万丈三上下' * 3
+        for wrap in (False, True):
+            with self.subTest(wrap=wrap):
+                self.assertFits(self.layout(text, wrap))
+
+    def test_long_word_is_broken(self):
+        lines = self.layout('z ' + 'd' * 40, wrap=True)
+        self.assertFits(lines)
+        self.assertEqual(len(lines[0]), 2)
+        self.assertEqual(sum(map(len, lines)), 42)
+
+    def test_word_is_carried(self):
+        lines = self.layout('a ' * 64 + 'bbb', wrap=True)
+        self.assertFits(lines)
+        b = self.font['b']
+        self.assertEqual([char for char, _ in lines[-1]].count(b), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -987,6 +987,32 @@ class Main {
         Ev.dispatch('#device-options', 'change');
         return devices.length;
     }
+    /**
+     * Wait for a print job to end, by events from server, or by polling if not supported
+     * @param {{ id: number, status: string }} job
+     */
+    async waitJob(job) {
+        const ended = (job) => job.status !== 'queued' && job.status !== 'running';
+        if (!window.EventSource) {
+            while (!ended(job)) {
+                await new Promise(resolve => setTimeout(resolve, 500));
+                job = await callApi('/job', { id: job.id });
+            }
+            return job;
+        }
+        return await new Promise((resolve) => {
+            const source = new EventSource('/events');
+            const check = (data) => {
+                if (data.id !== job.id || !ended(data)) return;
+                source.close();
+                resolve(data);
+            };
+            // the job may end before we're listening
+            source.addEventListener('open', () => callApi('/job', { id: job.id }).then(check));
+            for (const type of ['finished', 'failed', 'cancelled'])
+                source.addEventListener(type, (event) => check(JSON.parse(event.data)));
+        });
+    }
     async print() {
         if (this.canvasController.imageUrl === null) return;
         await this.set(this.settings);
@@ -1008,9 +1034,15 @@ class Main {
             method: 'POST',
             body: this.canvasController.makePbm()
         }).then(async (response) => {
-            if (response.ok) { Notice.note('finished'); return; }
             let json = response.json();
             response.json = () => json;
+            if (response.ok) {
+                // the job is queued. wait for it to end
+                const job = await this.waitJob(await response.json());
+                if (job.status === 'done') Notice.note('finished');
+                if (job.status !== 'failed') return;
+                json = Promise.resolve(job.error);
+            }
             let error_data = await response.json();
             if (/address.+not found|Not connected/.test(error_data.details) ||
                     error_data.name === 'EOFError') {